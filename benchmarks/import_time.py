@@ -0,0 +1,76 @@
+#!/bin/python
+
+""" Import time benchmark of the command line.
+
+    Runs a few startup scenarios in fresh interpreters and reports the best wall time
+    of each, plus the slowest imports seen by python -X importtime. It exits with an
+    error if a scenario imports a module it should not need (e.g. NLTK when only
+    parsing), or if a scenario is slower than --max-ms: it can run in CI as is.
+
+    Run from the root of the repository: python3 benchmarks/import_time.py """
+
+import os, sys, argparse, subprocess, time
+
+
+
+rootDir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+heavy = [ "nltk", "numpy", "lxml", "xmind", "openpyxl", "xlrd", "excel", "progressbar" ]
+
+# name, python arguments, modules that must not be imported
+scenarios = [
+    ( "help", [ "reqmapper.py", "--help" ], heavy + [ "yaml" ] ),
+    ( "import", [ "-c", "import reqmapper" ], heavy + [ "yaml" ] ),
+    ( "parse", [ "-c", "import reqmapper, requirements; requirements.Parser; requirements.TraceabilityAnalysis" ], [ "nltk", "numpy", "lxml", "xmind" ] ),
+    ( "render", [ "-c", "import reqmapper, requirements; requirements.UnifiedRenderer" ], [ "nltk", "numpy" ] ),
+]
+
+def run(arguments):
+    start = time.perf_counter()
+    result = subprocess.run([sys.executable, "-X", "importtime"] + arguments, cwd=rootDir, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE, text=True)
+    elapsed = (time.perf_counter() - start) * 1000
+    if result.returncode != 0:
+        raise Exception("%s failed:\n%s" % (" ".join(arguments), result.stderr))
+
+    # lines look like: "import time:       self |  cumulative | <indent>module"
+    imports = []
+    for line in result.stderr.splitlines():
+        if line.startswith("import time:") and "|" in line:
+            fields = line[len("import time:"):].split("|")
+            if fields[1].strip().isdigit():
+                imports.append( (int(fields[1]), fields[2].rstrip()) )
+
+    return (elapsed, imports)
+
+def main():
+    parser = argparse.ArgumentParser(description="Measure the startup time of reqmapper.py")
+    parser.add_argument("-r", "--repeat", default=5, type=int, action="store", help="Runs of each scenario, the best one is reported (default: 5)")
+    parser.add_argument("-m", "--max-ms", default=None, type=float, action="store", help="Fail if the best run of a scenario takes longer than this")
+    parser.add_argument("-t", "--top", default=5, type=int, action="store", help="Number of slowest top level imports to show (default: 5)")
+    args = parser.parse_args()
+
+    failures = []
+    for name, arguments, forbidden in scenarios:
+        runs = [run(arguments) for i in range(0, args.repeat)]
+        (best, imports) = min(runs, key=lambda r: r[0])
+
+        modules = set(module.strip() for cumulative, module in imports)
+        unexpected = sorted(m for m in forbidden if m in modules)
+
+        print("%-8s %8.1f ms" % (name, best))
+        toplevel = [ (cumulative, module) for cumulative, module in imports if not module.startswith("  ") ]
+        for cumulative, module in sorted(toplevel, reverse=True)[:args.top]:
+            print("           %8.1f ms  %s" % (cumulative / 1000.0, module.strip()))
+
+        if len(unexpected) > 0:
+            failures.append("%s imports %s" % (name, ", ".join(unexpected)))
+
+        if args.max_ms is not None and best > args.max_ms:
+            failures.append("%s takes %.1f ms, more than %.1f ms" % (name, best, args.max_ms))
+
+    if len(failures) > 0:
+        print("\nFAILED:\n%s" % "\n".join(failures))
+        sys.exit(1)
+
+if __name__ == "__main__":
+    main()
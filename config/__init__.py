@@ -1,11 +1,12 @@
-import yaml
-
 _configFileName="config.yaml"
 _data=None
 
 def _loadconfig():
     global _data
     if _data is None:
+        # yaml is only imported when the configuration is first needed
+        import yaml
+
         with open(_configFileName, 'r') as stream:
             _data = yaml.safe_load(stream)
 
@@ -113,3 +114,29 @@ def getMapStyle(what):
 
     return styles[style]
 
+def getParserBackend():
+    _loadconfig()
+
+    result = "excel"
+    if "parser" in _data.keys() and "backend" in _data["parser"]:
+        result = _data["parser"]["backend"]
+
+    return result
+
+def getSortOrder():
+    _loadconfig()
+
+    result = ["Priority", "Risk", "Difficulty"]
+    if "rendering" in _data.keys() and "sortOrder" in _data["rendering"]:
+        result = _data["rendering"]["sortOrder"]
+
+    return result
+
+def getShardTopics():
+    _loadconfig()
+
+    result = 20000
+    if "rendering" in _data.keys() and "shardTopics" in _data["rendering"]:
+        result = _data["rendering"]["shardTopics"]
+
+    return result
@@ -1,7 +1,10 @@
 #!/bin/python
 
 import os, sys, argparse
-from requirements import Parser
+from requirements import Parser, TraceabilityGraph, TraceabilityAnalysis
+from requirements.parser import parseFile
+from requirements.cache import ParseCache, defaultCacheDir
+import config
 
 
 
@@ -15,16 +18,13 @@ from requirements import Parser
 
 
 rootDir="sources"
-filename="requirements"
+defaultFilename="requirements"
 
 
 
 
 
 
-reqs={}
-chapters=[]
-
 categories={ "U":"user", "B": "business", "S": "system" }
 
 def checkSensitivity(v):
@@ -34,89 +34,276 @@ def checkSensitivity(v):
 
     return s
 
+def checkJobs(v):
+    j = int(v)
+    if j < 1:
+        raise argparse.ArgumentTypeError("%s should be a positive number of parallel jobs" % v)
 
-parser = argparse.ArgumentParser()
-parser.add_argument("-i", "--independent", default=False, action="store_true", help="Produce two separate maps, one for topdown the other for bottomup. Requirements are always the same, but the two maps provide topdown and bottomup traceability between them")
-parser.add_argument("-d", "--directory", default=rootDir, action="store", help="The folder containing the sources for the requirements, in xls/xlsx Excel spreadsheets")
-parser.add_argument("-f", "--filename", default=filename, action="store", help="The filename to use for the rendered XMind map(s) (default: %s.xmind)" % filename)
-parser.add_argument("-p", "--no_orphans", default=False, action="store_true", help="Do not show issues such as orphaned and non-linked requirements")
-parser.add_argument("-n", "--no_folded", default=False, action="store_true", help="Do not render all topics as folded")
-parser.add_argument("-k", "--semantic", default=False, action="store_true", help="Check requirements for duplicates and other issues")
-parser.add_argument("-v", "--verbose", default=False, action="store_true", help="Print additional information when parsing and rendering requirements")
-parser.add_argument("-S", "--strict", default=False, action="store_true", help="Be less permissive when parsing requirements. By default, the parser will try to work around issues in the parsing using sensible defaults (es.: assume that Difficulty is Low if the actual value is illegal).")
-parser.add_argument("-s", "--minScore", default=0.8, action="store", type=checkSensitivity, help="Minimum semantic similarity score to be used (defaults to 0.0). Can be used to increase the amount of results reported when performing semantic checks on requirements")
-parser.add_argument("-m", "--maxScore", default=1.0, action="store", type=checkSensitivity, help="Maximum semantic similarity score to be used (defaults to 1.0). Can be used to limit the amount of results reported when performing semantic checks on the requirements.")
-
-args = parser.parse_args()
-
-semantic=args.semantic
-minScore=args.minScore
-maxScore=args.maxScore
-verbose=args.verbose
-strict=args.strict
-independent=args.independent
-filename=args.filename
-
-for root, dirs, files in os.walk(args.directory):
-    for f in files:
-        if f.endswith("xlsx"):
-            category = "unknown"
-            if f[0] in categories.keys():
-                category = categories[f[0]]
+    return j
 
-            print("Parsing file %s for category %s" % (f, category))
-            p = Parser( category, os.path.join(root, f), strict, verbose)
-            (c, r, alerts) = p.parse()
+def checkDepth(v):
+    d = int(v)
+    if d < 1:
+        raise argparse.ArgumentTypeError("%s should be a positive number of levels" % v)
+
+    return d
+
+def checkTopics(v):
+    t = int(v)
+    if t < 1:
+        raise argparse.ArgumentTypeError("%s should be a positive number of topics" % v)
+
+    return t
+
+def checkCompression(v):
+    level = int(v)
+    if level < 0 or level > 9:
+        raise argparse.ArgumentTypeError("%s should be a compression level between 0 and 9" % v)
+
+    return level
 
-            for k, i in r.items():
-                if k in reqs.keys():
-                    print("WARNING: requirement %s from file %s has a duplicate ID" % (i.getID(), f))
+def findSources(directory):
+    sources = []
+    for root, dirs, files in os.walk(directory):
+        for f in files:
+            if f.endswith("xlsx"):
+                category = "unknown"
+                if f[0] in categories.keys():
+                    category = categories[f[0]]
 
-            reqs.update(r)
-            chapters.extend(c)
+                sources.append( (category, root, f) )
 
-print("%d total requirements parsed\n" % len(reqs))
+    return sources
 
+def parseSources(sources, strict, verbose, jobs=1, backend=None, cache=None):
+    reqs = {}
+    chapters = []
+    results = [None] * len(sources)
+    fingerprints = [None] * len(sources)
 
+    if cache is not None:
+        # the cache entries depend on the backend actually used
+        if backend is None:
+            backend = config.getParserBackend()
 
-if not semantic:
+        cache.prune()
+        for n, (category, root, f) in enumerate(sources):
+            # taken before parsing, so that an edit made meanwhile is not recorded as parsed
+            fingerprints[n] = cache.fingerprint(category, os.path.join(root, f), strict, backend)
+            results[n] = cache.load(os.path.join(root, f), fingerprints[n])
+            if results[n] is not None:
+                print("Using cached requirements for file %s for category %s" % (f, category))
 
-    if not independent:
-        from requirements import UnifiedRenderer
+    missing = [n for n in range(0, len(sources)) if results[n] is None]
 
-        r = UnifiedRenderer(chapters, reqs, renderFolded=(not args.no_folded), verbose=verbose)
-        fname = "%s.xmind" % filename
-        r.render( fname )
+    if jobs > 1 and len(missing) > 1:
+        for n in missing:
+            print("Parsing file %s for category %s" % (sources[n][2], sources[n][0]))
 
-        print("Rendered to %s" % fname)
+        from concurrent.futures import ProcessPoolExecutor
 
+        # results come back in file order, so the merge below is the same as in the serial path
+        with ProcessPoolExecutor(max_workers=min(jobs, len(missing))) as pool:
+            work = [ (sources[n][0], os.path.join(sources[n][1], sources[n][2]), strict, verbose, backend) for n in missing ]
+            for n, result in zip(missing, pool.map(parseFile, *zip(*work))):
+                results[n] = result
     else:
-        from requirements import TopDownRenderer, BottomUpRenderer
+        for n in missing:
+            category, root, f = sources[n]
+            print("Parsing file %s for category %s" % (f, category))
+            p = Parser( category, os.path.join(root, f), strict, verbose, backend)
+            results[n] = p.parse()
+
+    for n in range(0, len(sources)):
+        category, root, f = sources[n]
+        if cache is not None and n in missing:
+            cache.store(os.path.join(root, f), fingerprints[n], results[n])
+
+        (c, r, alerts) = results[n]
+        mergeRequirements(reqs, chapters, f, c, r)
+
+    return (chapters, reqs)
+
+def mergeRequirements(reqs, chapters, f, c, r):
+    for k, i in r.items():
+        if k in reqs.keys():
+            print("WARNING: requirement %s from file %s has a duplicate ID" % (i.getID(), f))
+
+    reqs.update(r)
+    chapters.extend(c)
+
+def renderMap(rendererClass, chapters, reqs, options, filename):
+    r = rendererClass(chapters, reqs, **options)
+    r.render(filename)
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("-i", "--independent", default=False, action="store_true", help="Produce two separate maps, one for topdown the other for bottomup. Requirements are always the same, but the two maps provide topdown and bottomup traceability between them")
+    parser.add_argument("-d", "--directory", default=rootDir, action="store", help="The folder containing the sources for the requirements, in xls/xlsx Excel spreadsheets")
+    parser.add_argument("-f", "--filename", default=defaultFilename, action="store", help="The filename to use for the rendered XMind map(s) (default: %s.xmind)" % defaultFilename)
+    parser.add_argument("-p", "--no_orphans", default=False, action="store_true", help="Do not show issues such as orphaned and non-linked requirements")
+    parser.add_argument("-n", "--no_folded", default=False, action="store_true", help="Do not render all topics as folded")
+    parser.add_argument("--max-depth", default=999, action="store", type=checkDepth, help="Maximum number of levels of requirements rendered below each chapter (default: 999). Link cycles are always cut, and reported in the Issues sheet")
+    parser.add_argument("--shard", default=False, action="store_true", help="Split the map in several files, for maps too large for XMind: a top-down map for each business chapter, a bottom-up map for each system chapter, and an index map linking to them, with the issues and conventions")
+    parser.add_argument("--shard-topics", default=None, action="store", type=checkTopics, help="With --shard, the maximum number of topics of each map: larger chapters are split in several maps (default: shardTopics in config.yaml)")
+    parser.add_argument("--streaming", default=False, action="store_true", help="Write the topics of the map out while rendering it, instead of building the whole map in memory first. Meant for very large maps, the result is the same")
+    parser.add_argument("--share-subtrees", default=False, action="store_true", help="Render the subtree of each requirement once per sheet: later occurrences are reference topics linking to it. Keeps very interlinked maps linear in size")
+    parser.add_argument("-z", "--compress", default=0, action="store", type=checkCompression, help="Compress the rendered map(s) with DEFLATE at this level, from 1 (fastest) to 9 (smallest). Defaults to 0, no compression")
+    parser.add_argument("--diff", default=None, action="store", nargs=2, metavar=("OLD", "NEW"), help="Compare two rendered maps instead of rendering one: report the requirements added, removed, moved or with changed markers from OLD to NEW, and save the changes as a map to <filename>-changes.xmind")
+    parser.add_argument("--diff-json", default=False, action="store_true", help="With --diff, save the changes as JSON to <filename>-changes.json instead of a map")
+    parser.add_argument("-k", "--semantic", default=False, action="store_true", help="Check requirements for duplicates and other issues")
+    parser.add_argument("-r", "--report", default=False, action="store_true", help="Print a traceability report (orphans, requirements without links, dangling links, links between unexpected categories and link cycles) instead of rendering a map")
+    parser.add_argument("-v", "--verbose", default=False, action="store_true", help="Print additional information when parsing and rendering requirements")
+    parser.add_argument("-S", "--strict", default=False, action="store_true", help="Be less permissive when parsing requirements. By default, the parser will try to work around issues in the parsing using sensible defaults (es.: assume that Difficulty is Low if the actual value is illegal).")
+    parser.add_argument("-s", "--minScore", default=0.8, action="store", type=checkSensitivity, help="Minimum semantic similarity score to be used (defaults to 0.0). Can be used to increase the amount of results reported when performing semantic checks on requirements")
+    parser.add_argument("-m", "--maxScore", default=1.0, action="store", type=checkSensitivity, help="Maximum semantic similarity score to be used (defaults to 1.0). Can be used to limit the amount of results reported when performing semantic checks on the requirements.")
+    parser.add_argument("-o", "--overlap", default=0.0, action="store", type=checkSensitivity, help="Semantic scan prefilter: only score the pairs of requirements sharing at least this fraction of the synsets of the shorter one (defaults to 0.0, no prefilter). Lower values favour recall, higher values favour speed")
+    parser.add_argument("--prefilter-report", default=False, action="store_true", help="With -k, only report how many pairs of requirements the prefilter (see --overlap) would score and prune, without scoring them")
+    parser.add_argument("--baseline", default=None, action="store", help="With -k, a JSON file holding the result of the previous semantic scan: only the requirements added or changed since are rescored, and the file is updated with the result of this scan")
+    parser.add_argument("-b", "--backend", default=None, action="store", choices=["excel", "streaming"], help="How source spreadsheets are read: 'excel' loads whole sheets in memory, 'streaming' reads rows lazily with flat memory use (default: the parser backend in config.yaml)")
+    parser.add_argument("--cache-dir", default=defaultCacheDir, action="store", help="The folder where parsed source files, and the sheets of the rendered map, are cached between runs (default: %s)" % defaultCacheDir)
+    parser.add_argument("--no-cache", default=False, action="store_true", help="Always parse the source files and render all the sheets, ignoring and not updating the cache")
+    parser.add_argument("-j", "--jobs", default=1, action="store", type=checkJobs, help="Number of parallel processes used to parse the source files and to run the semantic scan, and of threads compressing the map (defaults to 1). With more than one job, the sheets of the map (or the two maps, with -i) are rendered by parallel processes")
+
+    args = parser.parse_args()
+
+    semantic=args.semantic
+    report=args.report
+    minScore=args.minScore
+    maxScore=args.maxScore
+    verbose=args.verbose
+    strict=args.strict
+    independent=args.independent
+    filename=args.filename
+
+    if args.diff is not None:
+        from requirements.mapdiff import MapDiff
+
+        # the maps are compared as rendered, the sources are not needed
+        d = MapDiff(args.diff[0], args.diff[1])
+        d.printSummary(verbose)
+
+        if args.diff_json:
+            fname = "%s-changes.json" % filename
+            d.saveJSON(fname)
+        else:
+            fname = "%s-changes.xmind" % filename
+            d.render(fname)
+
+        print("Saved the changes to %s" % fname)
+        return
+
+    cache = None
+    if not args.no_cache:
+        cache = ParseCache(args.cache_dir)
+
+    (chapters, reqs) = parseSources(findSources(args.directory), strict, verbose, args.jobs, args.backend, cache)
+
+    print("%d total requirements parsed\n" % len(reqs))
+
+    # the traceability graph is built once and shared by all the renderers
+    graph = TraceabilityGraph(reqs)
+    analysis = TraceabilityAnalysis(reqs, graph)
+
+    if report:
+        analysis.printReport(verbose)
+
+    elif not semantic:
+
+        if args.shard:
+            from requirements import ShardedRenderer
+
+            topicBudget = args.shard_topics
+            if topicBudget is None:
+                topicBudget = config.getShardTopics()
+
+            r = ShardedRenderer(chapters, reqs, topicBudget, renderFolded=(not args.no_folded), maxDepth=args.max_depth, verbose=verbose, graph=graph, analysis=analysis, streaming=args.streaming, compressLevel=args.compress, jobs=args.jobs, shareSubtrees=args.share_subtrees)
+            fname = "%s.xmind" % filename
+            r.render( fname )
+
+            print("Rendered the index to %s" % fname)
+
+        elif not independent:
+            from requirements import UnifiedRenderer
+            from requirements.sheetcache import SheetCache
+
+            sheetCache = None
+            if not args.no_cache:
+                sheetCache = SheetCache(args.cache_dir)
+
+            r = UnifiedRenderer(chapters, reqs, renderFolded=(not args.no_folded), maxDepth=args.max_depth, verbose=verbose, graph=graph, analysis=analysis, streaming=args.streaming, compressLevel=args.compress, jobs=args.jobs, shareSubtrees=args.share_subtrees, sheetCache=sheetCache)
+            fname = "%s.xmind" % filename
+            r.render( fname )
+
+            print("Rendered to %s" % fname)
+
+        else:
+            from requirements import TopDownRenderer, BottomUpRenderer
+
+            fname = "%s-topdown.xmind" % filename
+            fname2 = "%s-bottomup.xmind" % filename
+            options = { "renderOrphans": (not args.no_orphans), "renderFolded": (not args.no_folded), "maxDepth": args.max_depth, "verbose": verbose, "graph": graph, "analysis": analysis,
+                        "streaming": args.streaming, "compressLevel": args.compress, "jobs": args.jobs, "shareSubtrees": args.share_subtrees }
+
+            if args.jobs > 1:
+                from concurrent.futures import ProcessPoolExecutor
+
+                # each map is a separate document, rendered by its own process
+                with ProcessPoolExecutor(max_workers=2) as pool:
+                    work = [ pool.submit(renderMap, TopDownRenderer, chapters, reqs, options, fname), pool.submit(renderMap, BottomUpRenderer, chapters, reqs, options, fname2) ]
+                    for result in work:
+                        result.result()
+            else:
+                renderMap(TopDownRenderer, chapters, reqs, options, fname)
+                renderMap(BottomUpRenderer, chapters, reqs, options, fname2)
+
+            print("Rendered to files %s and %s." % (fname, fname2))
+
+    else:
+        from requirements.checker import SemanticChecker
+        from requirements.semcache import SemanticCache
+        from requirements.baseline import SemanticBaseline
+
+        print("Running a semantic scan on the requirements to identify potential duplicates.")
+        semanticCache = None
+        if not args.no_cache:
+            semanticCache = SemanticCache(os.path.join(args.cache_dir, "semantic.sqlite"))
+
+        checker = SemanticChecker(reqs, minScore=minScore, maxScore=maxScore, jobs=args.jobs, minOverlap=args.overlap, cache=semanticCache)
 
-        fname = "%s-topdown.xmind" % filename
-        r = TopDownRenderer(chapters, reqs, renderOrphans=(not args.no_orphans), renderFolded=(not args.no_folded), verbose=verbose)
-        r.render(fname )
+        if args.prefilter_report:
+            total = checker.totalPairs()
+            candidates = checker.countCandidates()
+            print("%d pairs of requirements, %d would be scored and %d pruned by the prefilter (overlap %s)" % (total, candidates, total - candidates, args.overlap))
+            if semanticCache is not None:
+                semanticCache.close()
+            return
 
-        fname2 = "%s-bottomup.xmind" % filename
-        r = BottomUpRenderer(chapters, reqs, renderOrphans=(not args.no_orphans), renderFolded=(not args.no_folded), verbose=verbose)
-        r.render( fname2)
+        baseline = None
+        if args.baseline is not None:
+            baseline = SemanticBaseline(args.baseline)
 
-        print("Rendered to files %s and %s." % (fname, fname2))
+        (sims, ranges) = checker.check(baseline.load() if baseline is not None else None)
+        if semanticCache is not None:
+            semanticCache.close()
 
-else:
-    from requirements.checker import SemanticChecker
+        if baseline is not None:
+            baseline.save(checker.baseline)
 
-    print("Running a semantic scan on the requirements to identify potential duplicates.")
-    checker = SemanticChecker(reqs, minScore=minScore, maxScore=maxScore)
-    (sims, ranges) = checker.check()
+        if checker.incremental:
+            print("%d pairs of requirements rescored since the baseline" % checker.scoredPairs)
+        elif args.overlap > 0:
+            print("%d pairs of requirements scored, %d pruned by the prefilter" % (checker.scoredPairs, checker.totalPairs() - checker.scoredPairs))
 
-    print("\nSimilarity ranges (every requirements is checked against all the others):")
-    for i in sorted(ranges):
-        v = ranges[i]
-        print("Percentile %s: %d matches" % (i, v))
-        #print("%d requirements checks scored between %d and %d" % (ranges[i], i, (i+1)))
+        print("\nSimilarity ranges (every requirements is checked against all the others):")
+        for i in sorted(ranges):
+            v = ranges[i]
+            print("Percentile %s: %d matches" % (i, v))
+            #print("%d requirements checks scored between %d and %d" % (ranges[i], i, (i+1)))
 
-    print("\n")
+        print("\n")
 
-    checker.prettyPrint(sims)
+        checker.prettyPrint(sims)
 
+if __name__ == "__main__":
+    main()
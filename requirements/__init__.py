@@ -1,4 +1,23 @@
-from .requirement import Attribute, Requirement
-from .parser import Parser
-from .renderer import BottomUpRenderer, TopDownRenderer, Renderer, UnifiedRenderer
+import importlib
+
+# the submodules are only imported when one of their names is first used, so that the
+# command line does not pay for the xmind/lxml stack (or NLTK) when it does not need it
+_exports = { "Attribute": "requirement", "Requirement": "requirement",
+             "Parser": "parser",
+             "TraceabilityGraph": "graph",
+             "TraceabilityAnalysis": "analysis",
+             "BottomUpRenderer": "renderer", "TopDownRenderer": "renderer", "Renderer": "renderer", "UnifiedRenderer": "renderer", "ShardedRenderer": "renderer" }
+
+__all__ = list(_exports.keys())
+
+def __getattr__(name):
+    if name not in _exports:
+        raise AttributeError("module %r has no attribute %r" % (__name__, name))
+
+    value = getattr(importlib.import_module("." + _exports[name], __name__), name)
+    globals()[name] = value
+    return value
+
+def __dir__():
+    return sorted(list(globals().keys()) + __all__)
 
@@ -0,0 +1,168 @@
+from .graph import TraceabilityGraph
+
+
+
+
+
+class TraceabilityAnalysis:
+    """ Single pass traceability checks over the link graph: orphans, requirements
+        without links, dangling links, cross-category links and link cycles """
+
+    levelsProgression = ['system', 'user', 'business']
+
+    def __init__(self, requirements, graph=None):
+        self.requirements = requirements
+        self.graph = graph
+        if self.graph is None:
+            self.graph = TraceabilityGraph(requirements)
+
+        self.orphans = {}
+        self.nolinks = {}
+        self.dangling = []
+        self.violations = []
+        self.cycles = []
+
+        self.analyze()
+
+    def expectedCategory(self, category):
+        """ The category a requirement of the given category is expected to link to """
+        result = None
+        if category in self.levelsProgression:
+            i = self.levelsProgression.index(category)
+            if i > 0:
+                result = self.levelsProgression[i-1]
+
+        return result
+
+    def analyze(self):
+        for cat in self.levelsProgression:
+            self.orphans[cat] = []
+            self.nolinks[cat] = []
+
+        for key, req in self.requirements.items():
+            reqID = req.getID()
+            category = req.getCategory()
+            links = self.graph.getLinks(reqID)
+
+            # business requirements are roots, nobody is expected to link them
+            if category in self.levelsProgression[:-1] and not self.graph.isLinked(reqID):
+                self.orphans[category].append(key)
+
+            # system requirements are leaves, they are not expected to link anything
+            if category in self.levelsProgression[1:] and len(links) == 0:
+                self.nolinks[category].append(key)
+
+            expected = self.expectedCategory(category)
+            for link in links:
+                target = self.requirements.get(link)
+                if target is None:
+                    self.dangling.append( (reqID, link) )
+                elif category in self.levelsProgression and target.getCategory() in self.levelsProgression and target.getCategory() != expected:
+                    self.violations.append( (reqID, link) )
+
+        self.cycles = self.findCycles()
+
+    def successors(self, reqID):
+        return [l for l in self.graph.getLinks(reqID) if l in self.requirements]
+
+    def findCycles(self):
+        """ Strongly connected components of the link graph (Tarjan), computed
+            without recursion. Each component with more than one requirement,
+            or a requirement linking itself, is a cycle """
+        cycles = []
+        index = {}
+        lowlink = {}
+        stack = []
+        onStack = set()
+        counter = 0
+
+        for start in self.graph.forward.keys():
+            if start in index:
+                continue
+
+            index[start] = lowlink[start] = counter
+            counter += 1
+            stack.append(start)
+            onStack.add(start)
+            work = [ (start, iter(self.successors(start))) ]
+
+            while len(work) > 0:
+                node, children = work[-1]
+                descended = False
+                for child in children:
+                    if child not in index:
+                        index[child] = lowlink[child] = counter
+                        counter += 1
+                        stack.append(child)
+                        onStack.add(child)
+                        work.append( (child, iter(self.successors(child))) )
+                        descended = True
+                        break
+                    elif child in onStack:
+                        lowlink[node] = min(lowlink[node], index[child])
+
+                if descended:
+                    continue
+
+                work.pop()
+                if len(work) > 0:
+                    parent = work[-1][0]
+                    lowlink[parent] = min(lowlink[parent], lowlink[node])
+
+                if lowlink[node] == index[node]:
+                    component = []
+                    while True:
+                        member = stack.pop()
+                        onStack.discard(member)
+                        component.append(member)
+                        if member == node:
+                            break
+
+                    if len(component) > 1 or node in self.graph.getLinks(node):
+                        component.reverse()
+                        cycles.append(component)
+
+        return cycles
+
+    def getOrphans(self, category):
+        return self.orphans.get(category, [])
+
+    def getNoLinks(self, category):
+        return self.nolinks.get(category, [])
+
+    def getDanglingLinks(self):
+        return self.dangling
+
+    def getCategoryViolations(self):
+        return self.violations
+
+    def getCycles(self):
+        return self.cycles
+
+    def printReport(self, verbose=False):
+        for cat in self.levelsProgression[:-1]:
+            orphans = self.getOrphans(cat)
+            print("%d orphaned %s requirement(s)" % (len(orphans), cat))
+            if verbose and len(orphans) > 0:
+                print("    %s" % ", ".join(orphans))
+
+        for cat in self.levelsProgression[1:]:
+            nolinks = self.getNoLinks(cat)
+            print("%d %s requirement(s) without links" % (len(nolinks), cat))
+            if verbose and len(nolinks) > 0:
+                print("    %s" % ", ".join(nolinks))
+
+        print("%d dangling link(s) to requirements that do not exist" % len(self.dangling))
+        if verbose:
+            for source, target in self.dangling:
+                print("    %s -> %s" % (source, target))
+
+        print("%d link(s) between unexpected categories" % len(self.violations))
+        if verbose:
+            for source, target in self.violations:
+                print("    %s (%s) -> %s (%s)" % (source, self.requirements[source].getCategory(), target, self.requirements[target].getCategory()))
+
+        print("%d link cycle(s)" % len(self.cycles))
+        if verbose:
+            for cycle in self.cycles:
+                print("    %s" % ", ".join(cycle))
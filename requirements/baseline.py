@@ -0,0 +1,52 @@
+import os, json
+
+
+
+
+
+# bump whenever the layout of the baseline changes
+BASELINE_VERSION = 1
+
+class SemanticBaseline:
+    """ The outcome of a semantic scan, saved as JSON so that the next scan only rescores
+        the requirements that were added or changed since. It holds the settings of the
+        scan, the text hash and synsets of each requirement (by CodeName), the reported
+        pairs and the histogram of all the scores """
+
+    def __init__(self, path):
+        self.path = path
+
+    def load(self):
+        """ The saved baseline, or None if there is none or it cannot be used """
+        if not os.path.exists(self.path):
+            return None
+
+        try:
+            with open(self.path, "r") as f:
+                data = json.load(f)
+        except Exception as e:
+            print("WARNING: ignoring unreadable semantic baseline %s (%s)" % (self.path, e))
+            return None
+
+        if data.get("version") != BASELINE_VERSION:
+            print("WARNING: ignoring semantic baseline %s, saved by another version" % self.path)
+            return None
+
+        # JSON object keys are strings
+        data["ranges"] = dict( (int(k), v) for k, v in data["ranges"].items() )
+        return data
+
+    def save(self, data):
+        directory = os.path.dirname(self.path)
+        if directory != "":
+            os.makedirs(directory, exist_ok=True)
+
+        data = dict(data)
+        data["version"] = BASELINE_VERSION
+
+        # write to a temporary file and rename, so an interrupted run never leaves a truncated baseline
+        tmp = "%s.%d.tmp" % (self.path, os.getpid())
+        with open(tmp, "w") as f:
+            json.dump(data, f)
+
+        os.replace(tmp, self.path)
@@ -0,0 +1,113 @@
+import os, hashlib, json, pickle
+import config
+
+
+
+
+
+# bump whenever the layout of the cached structures (Requirement, Attribute, chapters) changes
+CACHE_VERSION = 2
+
+defaultCacheDir = ".reqmapper-cache"
+
+class ParseCache:
+    """ On-disk cache of the parsed (chapters, reqs, alerts) tuple of each source file.
+
+        Each entry is a pickle holding a small fingerprint header followed by the parsed
+        structures. The fingerprint covers the size, mtime and content hash of the
+        source file, the attributes section of the configuration, the parsing mode and the
+        reader backend (xlrd and openpyxl do not report cells the same way), so a stale
+        entry is never used: it is evicted as soon as it is found.
+
+        The fingerprint is taken before parsing the file, and the same one is stored with
+        the result: a file edited while it was being parsed is parsed again on the next run """
+
+    def __init__(self, directory=defaultCacheDir):
+        self.directory = directory
+
+    def _entryPath(self, filename):
+        key = hashlib.sha1(os.path.abspath(filename).encode("utf-8")).hexdigest()
+        return os.path.join(self.directory, "parse-%s.pickle" % key)
+
+    @staticmethod
+    def _contentHash(filename):
+        h = hashlib.sha256()
+        with open(filename, "rb") as f:
+            for chunk in iter(lambda: f.read(1 << 20), b""):
+                h.update(chunk)
+
+        return h.hexdigest()
+
+    @staticmethod
+    def _configHash():
+        attributes = json.dumps(config.getAllAttributes(), sort_keys=True)
+        return hashlib.sha256(attributes.encode("utf-8")).hexdigest()
+
+    def fingerprint(self, category, filename, strict, backend):
+        st = os.stat(filename)
+        return { "version": CACHE_VERSION, "source": os.path.abspath(filename), "size": st.st_size, "mtime": st.st_mtime_ns,
+                 "category": category, "strict": strict, "backend": backend, "config": ParseCache._configHash(),
+                 "content": ParseCache._contentHash(filename) }
+
+    def _readHeader(self, path):
+        with open(path, "rb") as f:
+            return pickle.load(f)
+
+    def evict(self, filename):
+        path = self._entryPath(filename)
+        if os.path.exists(path):
+            os.remove(path)
+
+    def load(self, filename, fingerprint):
+        """ The cached parse result of filename, or None if missing or stale (its
+            fingerprint is not the current one of the file) """
+        path = self._entryPath(filename)
+        if not os.path.exists(path):
+            return None
+
+        try:
+            with open(path, "rb") as f:
+                header = pickle.load(f)
+                stale = header != fingerprint
+
+                result = None
+                if not stale:
+                    result = pickle.load(f)
+        except Exception as e:
+            print("WARNING: discarding unreadable cache entry for %s (%s)" % (filename, e))
+            stale = True
+            result = None
+
+        if stale:
+            self.evict(filename)
+
+        return result
+
+    def store(self, filename, fingerprint, result):
+        """ Save the parse result of filename, fingerprint being the one taken before parsing it """
+        os.makedirs(self.directory, exist_ok=True)
+        path = self._entryPath(filename)
+
+        # write to a temporary file and rename, so an interrupted run never leaves a truncated entry
+        tmp = "%s.%d.tmp" % (path, os.getpid())
+        with open(tmp, "wb") as f:
+            pickle.dump(fingerprint, f, protocol=pickle.HIGHEST_PROTOCOL)
+            pickle.dump(result, f, protocol=pickle.HIGHEST_PROTOCOL)
+
+        os.replace(tmp, path)
+
+    def prune(self):
+        """ Evict the entries whose source file does not exist anymore """
+        if not os.path.isdir(self.directory):
+            return
+
+        for name in os.listdir(self.directory):
+            if name.startswith("parse-") and name.endswith(".pickle"):
+                path = os.path.join(self.directory, name)
+                try:
+                    source = self._readHeader(path).get("source")
+                except Exception:
+                    source = None
+
+                if source is None or not os.path.exists(source):
+                    os.remove(path)
@@ -1,18 +1,37 @@
-from nltk import word_tokenize, pos_tag
-from nltk.corpus import wordnet as wn
+from concurrent.futures import ProcessPoolExecutor
+from collections import deque
+import bisect, math
+import numpy as np
 import progressbar
+from .semcache import SemanticCache
 
 
 
 
 
+# NLTK takes seconds to import and WordNet longer to load: both are only loaded by
+# the first tokenization or similarity computation, which a fully cached scan never needs
+wn = None
+word_tokenize = None
+pos_tag = None
+
+def _loadNltk():
+    global wn, word_tokenize, pos_tag
+    if wn is None:
+        from nltk import word_tokenize, pos_tag
+        from nltk.corpus import wordnet as wn
+
 class SemanticChecker:
-    def __init__(self, req, minScore=0.75, maxScore=1.0):
+    def __init__(self, req, minScore=0.75, maxScore=1.0, jobs=1, minOverlap=0.0, cache=None):
         self.requirements = req
+        self.cache = cache
         self.similarities = []
         self.threshold = minScore
         self.maxScore = maxScore
         self.valueRanges = {}
+        self.jobs = jobs
+        self.minOverlap = minOverlap
+        self.scoredPairs = 0
 
     def penn_to_wn(self, tag):
         """ Convert between a Penn Treebank tag to a simplified Wordnet tag """
@@ -33,24 +52,65 @@ class SemanticChecker:
         if wn_tag is None:
             return None
 
+        _loadNltk()
         try:
             return wn.synsets(word, wn_tag)[0]
         except:
             return None
 
-    def getSimilarity(self, sentence1, sentence2):
-        """ compute the sentence similarity using Wordnet """
+    def getSynsets(self, sentence):
+        """ the Wordnet synsets of the words of a sentence, in order """
         # Tokenize and tag
-        sentence1 = pos_tag(word_tokenize(sentence1))
-        sentence2 = pos_tag(word_tokenize(sentence2))
+        _loadNltk()
+        tagged = pos_tag(word_tokenize(sentence))
 
         # Get the synsets for the tagged words
-        synsets1 = [self.tagged_to_synset(*tagged_word) for tagged_word in sentence1]
-        synsets2 = [self.tagged_to_synset(*tagged_word) for tagged_word in sentence2]
+        synsets = [self.tagged_to_synset(*tagged_word) for tagged_word in tagged]
 
         # Filter out the Nones
-        synsets1 = [ss for ss in synsets1 if ss]
-        synsets2 = [ss for ss in synsets2 if ss]
+        return [ss for ss in synsets if ss]
+
+    def tagged_to_synset_name(self, word, tag):
+        wn_tag = self.penn_to_wn(tag)
+        if wn_tag is None:
+            return None
+
+        if self.cache is not None:
+            (found, name) = self.cache.getToken(word, wn_tag)
+            if found:
+                return name
+
+        ss = self.tagged_to_synset(word, tag)
+        name = ss.name() if ss else None
+        if self.cache is not None:
+            self.cache.putToken(word, wn_tag, name)
+
+        return name
+
+    def getSynsetNames(self, sentence):
+        """ the names of the Wordnet synsets of the words of a sentence, in order.
+            Sentences already seen in a previous run are not tokenized again """
+        if self.cache is not None:
+            names = self.cache.getVector(sentence)
+            if names is not None:
+                return names
+
+        _loadNltk()
+        names = []
+        for word, tag in pos_tag(word_tokenize(sentence)):
+            name = self.tagged_to_synset_name(word, tag)
+            if name is not None:
+                names.append(name)
+
+        if self.cache is not None:
+            self.cache.putVector(sentence, names)
+
+        return names
+
+    def getSimilarity(self, sentence1, sentence2):
+        """ compute the sentence similarity using Wordnet """
+        synsets1 = self.getSynsets(sentence1)
+        synsets2 = self.getSynsets(sentence2)
 
         score, count = 0.0, 0
 
@@ -79,39 +139,162 @@ class SemanticChecker:
 
         return score
 
-    def check(self):
-        similarities = []
-        counter=0
+    def getSettings(self):
+        """ the settings that the scores of a baseline depend on """
+        return { "minScore": self.threshold, "maxScore": self.maxScore, "minOverlap": self.minOverlap }
+
+    def getVectors(self, reqs):
+        vectors = [self.getSynsetNames(r.getFullText()) for r in reqs]
+        if self.cache is not None:
+            self.cache.commit()
+
+        return vectors
+
+    def check(self, baseline=None):
+        """ Score the pairs of requirements. When given the baseline saved by a previous scan
+            with the same settings, only the pairs involving an added or changed requirement
+            are scored, the others are taken from the baseline """
         self.valueRanges={}
+        self.emittedPairs = set()
+        self.scoredPairs = 0
+        self.incremental = False
 
         print("Using threshold %s to %s" % (self.threshold, self.maxScore))
-        with progressbar.ProgressBar(max_value=len(self.requirements)) as bar:
-            for reqkey1, req1 in self.requirements.items():
-                for reqkey2, req2 in self.requirements.items():
-                    if reqkey1 != reqkey2 and not self.isDuplicatePair(similarities, [req1, req2]):
-                        score = self.getSimilarity(req1.getFullText(), req2.getFullText())
-                        self.updateRanges(score)
+        reqs = list(self.requirements.values())
+        ids = [str(r.getID()) for r in reqs]
+        hashes = [SemanticCache.textHash(r.getFullText()) for r in reqs]
 
-                        if score >= self.threshold and score <= self.maxScore:
-                            similarities.append(  { "reqs": [req1, req2], "score": score } )
+        unchanged = None
+        if baseline is not None:
+            unchanged = self.compareBaseline(baseline, ids, hashes)
+
+        if unchanged is None:
+            vectors = self.getVectors(reqs)
+            self.fullScan(reqs, vectors)
+        else:
+            self.incremental = True
+            vectors = self.incrementalScan(reqs, ids, baseline, unchanged)
+
+        pairs = sorted(self.emittedPairs)
+        similarities = [ { "reqs": [reqs[i], reqs[j]], "score": self.emittedScores[(i, j)] } for i, j in pairs ]
+
+        self.baseline = { "settings": self.getSettings(), "ranges": self.valueRanges,
+                          "requirements": [ [ids[i], hashes[i], vectors[i]] for i in range(0, len(reqs)) ],
+                          "pairs": [ [ids[i], ids[j], self.emittedScores[(i, j)]] for i, j in pairs ] }
+
+        return (similarities, self.valueRanges)
+
+    def emit(self, i, j, score):
+        self.scoredPairs += 1
+        self.updateRanges(score)
+
+        if score >= self.threshold and score <= self.maxScore:
+            self.emittedPairs.add( (i, j) )
+            self.emittedScores[(i, j)] = score
+
+    def fullScan(self, reqs, vectors):
+        counter=0
+        self.emittedScores = {}
+        engine = SimilarityEngine(self, vectors, self.jobs, self.minOverlap)
+
+        with progressbar.ProgressBar(max_value=len(reqs)) as bar:
+            # each unordered pair is generated once, as (i, j) with i < j in the order of the requirements.
+            # Rows come back in order, whether they are scored here or in a process pool
+            for i, scores in engine.rows():
+                for j, score in scores:
+                    self.emit(i, j, score)
 
                 counter = counter + 1
                 bar.update(counter)
 
-        return (similarities, self.valueRanges)
+    def compareBaseline(self, baseline, ids, hashes):
+        """ The CodeNames of the requirements whose text did not change since the baseline,
+            or None if the baseline cannot be used and a full scan is needed """
+        if baseline.get("settings") != self.getSettings():
+            print("The semantic baseline was saved with different settings, running a full scan")
+            return None
 
-    def isDuplicatePair(self, pool, newPair):
-        result = False
-        for item in pool:
-            s = item['score']
-            pair = item['reqs']
-            if newPair[0] in pair and newPair[1] in pair:
-                result = True
-                break
+        if len(set(ids)) != len(ids):
+            print("Some requirements share the same CodeName, running a full scan")
+            return None
 
-        return result
+        current = dict(zip(ids, hashes))
+        unchanged = [reqID for reqID, h, names in baseline["requirements"] if current.get(reqID) == h]
+
+        # scores depend on the order of the two requirements of a pair, reordered requirements need a full scan
+        kept = set(unchanged)
+        if unchanged != [reqID for reqID in ids if reqID in kept]:
+            print("The order of the requirements changed since the semantic baseline, running a full scan")
+            return None
 
-    def updateRanges(self, score):
+        return kept
+
+    def incrementalScan(self, reqs, ids, baseline, unchanged):
+        n = len(reqs)
+        old = baseline["requirements"]
+        oldVectors = dict( (reqID, names) for reqID, h, names in old )
+        position = dict( (reqID, i) for i, reqID in enumerate(ids) )
+
+        # requirements that did not change keep the synsets of the baseline, only the others are tokenized
+        dirty = [i for i in range(0, n) if ids[i] not in unchanged]
+        vectors = [oldVectors[ids[i]] if ids[i] in unchanged else None for i in range(0, n)]
+        for i, names in zip(dirty, self.getVectors([reqs[i] for i in dirty])):
+            vectors[i] = names
+
+        # the previous version of the changed and removed requirements is scored too,
+        # to take its old scores out of the histogram of the baseline
+        stale = [entry for entry in old if entry[0] not in unchanged]
+        engine = SimilarityEngine(self, vectors + [entry[2] for entry in stale], self.jobs, self.minOverlap, focus=dirty + list(range(n, n + len(stale))))
+
+        removed = len([entry for entry in stale if entry[0] not in position])
+        print("%d requirement(s) added or changed and %d removed since the semantic baseline" % (len(dirty), removed))
+
+        self.valueRanges = dict(baseline["ranges"])
+        oldIndex = []
+        staleCounter = 0
+        for entry in old:
+            if entry[0] in unchanged:
+                oldIndex.append(position[entry[0]])
+            else:
+                oldIndex.append(n + staleCounter)
+                staleCounter += 1
+
+        staleOld = [k for k in range(0, len(old)) if old[k][0] not in unchanged]
+        for k in staleOld:
+            before = [oldIndex[b] for b in range(0, k) if old[b][0] in unchanged]
+            after = [oldIndex[a] for a in range(k + 1, len(old))]
+            for other, score in engine.scoreAround(oldIndex[k], before, after):
+                self.updateRanges(score, -1)
+
+        # pairs of unchanged requirements are still valid
+        self.emittedScores = {}
+        for id1, id2, score in baseline["pairs"]:
+            if id1 in unchanged and id2 in unchanged:
+                self.emittedPairs.add( (position[id1], position[id2]) )
+                self.emittedScores[(position[id1], position[id2])] = score
+
+        isDirty = set(dirty)
+        with progressbar.ProgressBar(max_value=len(dirty)) as bar:
+            for counter, i in enumerate(dirty):
+                before = [j for j in range(0, i) if j not in isDirty]
+                after = list(range(i + 1, n))
+                for j, score in engine.scoreAround(i, before, after):
+                    self.emit(min(i, j), max(i, j), score)
+
+                bar.update(counter + 1)
+
+        return vectors
+
+    def totalPairs(self):
+        n = len(self.requirements)
+        return n * (n - 1) // 2
+
+    def countCandidates(self):
+        """ The number of pairs the prefilter keeps, without scoring them """
+        engine = SimilarityEngine(self, self.getVectors(self.requirements.values()), self.jobs, self.minOverlap)
+        return engine.countCandidates()
+
+    def updateRanges(self, score, count=1):
         if score < 0:
             score = 0
 
@@ -119,11 +302,429 @@ class SemanticChecker:
         if v not in self.valueRanges.keys():
             self.valueRanges[v] = 0
 
-        self.valueRanges[v] += 1
+        self.valueRanges[v] += count
+        if self.valueRanges[v] == 0:
+            del self.valueRanges[v]
 
     def prettyPrint(self, similarities):
         for s in similarities:
             print("Req1: %s\nReq2: %s\n*** Score: %s\n" % (s['reqs'][0], s['reqs'][1], s['score']))
 
+# blocks of rows scored ahead of the consumer, per job
+BLOCKS_IN_FLIGHT = 2
+
+# synset similarities held at once by a full scan, in each block of rows of the matrix (8 bytes each)
+MATRIX_BLOCK_CELLS = 1 << 24
+
+class SimilarityEngine:
+    """ Computes the same scores as SemanticChecker.getSimilarity, but tokenizes, tags and
+        resolves the synsets of each requirement only once. Synset pair similarities (the
+        matrix) are computed once, and a sentence is scored against many others at once
+        with NumPy. With more than one job, both the similarities and the rows of scores
+        are computed in blocks by process pools.
+
+        The matrix is never held whole: a full scan goes through the sentences in order,
+        in chunks whose synsets fit in a block of MATRIX_BLOCK_CELLS similarities (their
+        rows of the matrix), or the rows of the synsets of the longest sentence if more. Rows
+        needed by consecutive chunks are carried over, the others are computed again (or read
+        from the cache) when needed again: with up to MATRIX_BLOCK_CELLS ** 0.5 synsets, a
+        single block holds them all. At the peak, while a block is built, this process holds
+        the previous block and the new one, the positions of the cells of the new one still
+        unknown (up to a block more, when nothing is cached) and SIMILARITY_BATCH similarities
+        on their way to the cache: about 384 MB. Each scoring process also gets a copy of the
+        block it scores against.
+
+        sentences are the synset names of each sentence. When only the pairs involving a few
+        of them are going to be scored, focus lists their positions: instead of the matrix, only
+        its rows and columns for the synsets of those sentences are loaded and computed, so the
+        cost is in proportion to the change rather than to the square of the number of synsets """
+
+    def __init__(self, checker, sentences, jobs=1, minOverlap=0.0, focus=None):
+        self.checker = checker
+        self.cache = checker.cache
+        self.jobs = jobs
+        self.synsetIndex = {}
+        self.names = []
+        self.vectors = []
+
+        for sentence in sentences:
+            vector = []
+            for name in sentence:
+                if name not in self.synsetIndex:
+                    self.synsetIndex[name] = len(self.names)
+                    self.names.append(name)
+
+                vector.append(self.synsetIndex[name])
+
+            self.vectors.append(np.array(vector, dtype=np.intp))
+
+        self.focus = None
+        if focus is not None:
+            self.focus = sorted(set(a for i in focus for a in self.vectors[i].tolist()))
+
+        self.index = None
+        if minOverlap > 0:
+            self.index = CandidateIndex(self.vectors, minOverlap)
+
+        self.focusBlocks = None
+        self.pool = None
+
+    def _blocks(self, sentences):
+        # a few blocks per job, each with about the same number of pairs (of the upper triangle),
+        # so that workers stay busy although the first rows are the longest ones
+        n = len(self.vectors)
+        target = max(1, sum(n - i - 1 for i in sentences) // (self.jobs * 8))
+        blocks = []
+        block, pairs = [], 0
+        for i in sentences:
+            block.append(i)
+            pairs += n - i - 1
+            if pairs >= target:
+                blocks.append(block)
+                block, pairs = [], 0
+
+        if len(block) > 0:
+            blocks.append(block)
+
+        return blocks
+
+    def _chunks(self):
+        """ Yields (sentences, their synsets): consecutive sentences whose synsets fit in a block
+            of rows of the matrix, or a single sentence when its own synsets do not """
+        maxRows = max(1, MATRIX_BLOCK_CELLS // max(1, len(self.names)))
+        chunk, synsets = [], set()
+        for i, vector in enumerate(self.vectors):
+            merged = synsets.union(vector.tolist())
+            if len(chunk) > 0 and len(merged) > maxRows:
+                yield chunk, synsets
+                chunk, merged = [], set(vector.tolist())
+
+            chunk.append(i)
+            synsets = merged
+
+        if len(chunk) > 0:
+            yield chunk, synsets
+
+    def buildRows(self, synsets, previous=None):
+        """ The rows of the matrix for the given synsets (sorted positions in the names), as
+            (rows, position of each synset among them, -1 for the others). A row is
+            path_similarity with every synset, -1 when it cannot be computed (the initial value
+            of the best score in getSimilarity). Rows of previous, an earlier result, are copied
+            from it, the others come from the cache: WordNet is only used for the cells still
+            unknown, after a change to the requirements those of the synsets not seen before """
+        n = len(self.names)
+        position = np.full(n, -1, dtype=np.intp)
+        position[synsets] = np.arange(len(synsets))
+
+        rows = np.full((len(synsets), n), np.nan)
+        missing = synsets
+        if previous is not None:
+            previousRows, previousPosition = previous
+            kept = synsets[previousPosition[synsets] >= 0]
+            rows[position[kept]] = previousRows[previousPosition[kept]]
+            missing = synsets[previousPosition[synsets] < 0]
+
+        if self.cache is not None and len(missing) > 0:
+            for (a, b), sc in self.cache.loadSimilarities(self.names, rows=[self.names[a] for a in missing.tolist()]):
+                rows[position[self.synsetIndex[a]], self.synsetIndex[b]] = -1.0 if sc is None else sc
+
+        cells = [ (a, np.flatnonzero(np.isnan(rows[position[a]]))) for a in missing.tolist() ]
+        cells = [ (a, others) for a, others in cells if len(others) > 0 ]
+        for (a, others), values in zip(cells, self._computeCells(cells)):
+            rows[position[a], others] = values
+
+        if self.cache is not None:
+            self.cache.commit()
+
+        return (rows, position)
+
+    def buildFocus(self):
+        """ The rows and the columns of the matrix for the synsets in focus, as (rows, columns,
+            position of each synset in focus, -1 for the others). Both blocks take the number of
+            synsets in focus times the number of synsets, and only their cells are loaded from
+            the cache """
+        n = len(self.names)
+        focus = np.array(self.focus, dtype=np.intp)
+        position = np.full(n, -1, dtype=np.intp)
+        position[focus] = np.arange(len(focus))
+
+        rows = np.full((len(focus), n), np.nan)
+        columns = np.full((n, len(focus)), np.nan)
+        if self.cache is not None:
+            focusNames = [self.names[a] for a in self.focus]
+            for (a, b), sc in self.cache.loadSimilarities(self.names, rows=focusNames, columns=focusNames):
+                a, b = self.synsetIndex[a], self.synsetIndex[b]
+                sc = -1.0 if sc is None else sc
+                if position[a] >= 0:
+                    rows[position[a], b] = sc
+                if position[b] >= 0:
+                    columns[a, position[b]] = sc
+
+        # the cells of the columns on the rows in focus are the ones of the rows, computed once
+        cells = [ (a, np.flatnonzero(np.isnan(rows[k]))) for k, a in enumerate(self.focus) ]
+        cells += [ (a, focus[np.isnan(columns[a])]) for a in np.flatnonzero(position < 0).tolist() ]
+        cells = [ (a, others) for a, others in cells if len(others) > 0 ]
+        for (a, others), values in zip(cells, self._computeCells(cells)):
+            if position[a] >= 0:
+                rows[position[a], others] = values
+            else:
+                columns[a, position[others]] = values
+
+        columns[focus] = rows[:, focus]
+        self._closePool()
+
+        if self.cache is not None:
+            self.cache.commit()
+
+        return (rows, columns, position)
+
+    def _cellBlocks(self, cells):
+        # a few blocks per job, each with about the same number of cells
+        target = max(1, sum(len(columns) for a, columns in cells) // (self.jobs * 8))
+        blocks = []
+        block, size = [], 0
+        for a, columns in cells:
+            block.append( (a, columns) )
+            size += len(columns)
+            if size >= target:
+                blocks.append(block)
+                block, size = [], 0
+
+        if len(block) > 0:
+            blocks.append(block)
+
+        return blocks
+
+    def _computeCells(self, cells):
+        """ path_similarity for the given cells of the matrix, as (row, columns) pairs: yields for
+            each row the values of its columns, adding them to the cache. With a pool, only a
+            few blocks of cells per job are in flight, as in _scoreChunk """
+        if self.jobs > 1 and len(cells) > 1:
+            # WordNet is loaded once per worker, the pool serves all the blocks of a scan
+            if self.pool is None:
+                self.pool = ProcessPoolExecutor(max_workers=self.jobs, initializer=_initMatrixWorker, initargs=(self.names, ))
+
+            pending = deque()
+            for block in self._cellBlocks(cells):
+                pending.append( (block, self.pool.submit(_matrixCells, block)) )
+                if len(pending) >= self.jobs * BLOCKS_IN_FLIGHT:
+                    block, result = pending.popleft()
+                    for row in self._storeCells(block, result.result()):
+                        yield row
+
+            while len(pending) > 0:
+                block, result = pending.popleft()
+                for row in self._storeCells(block, result.result()):
+                    yield row
+        elif len(cells) > 0:
+            _loadNltk()
+            synsets = [wn.synset(name) for name in self.names]
+            for cell in cells:
+                for row in self._storeCells([cell], _similarityCells(synsets, [cell])):
+                    yield row
+
+    def _storeCells(self, cells, values):
+        if self.cache is not None:
+            for (a, columns), row in zip(cells, values):
+                for b, sc in zip(columns.tolist(), row.tolist()):
+                    self.cache.putSimilarity(self.names[a], self.names[b], None if sc == -1.0 else sc)
+
+        return values
+
+    def _closePool(self):
+        if self.pool is not None:
+            self.pool.shutdown()
+            self.pool = None
+
+    def scoreAround(self, i, before, after):
+        """ (j, getSimilarity(j, i)) for each j in before and (j, getSimilarity(i, j)) for each
+            j in after, leaving out the pairs rejected by the prefilter. i must be in focus """
+        if self.index is not None:
+            related = self.index.related(i)
+            before = [j for j in before if j in related]
+            after = [j for j in after if j in related]
+
+        if self.focusBlocks is None:
+            self.focusBlocks = self.buildFocus()
+
+        rows, columns, position = self.focusBlocks
+        synsets = position[self.vectors[i]]
+        return list(zip(before, _scoreColumn(columns[:, synsets], self.vectors, before, i))) + list(zip(after, _scoreRow(rows[synsets], self.vectors, i, after)))
+
+    def rows(self):
+        """ Yields (i, [(j, getSimilarity(i, j)) for every candidate j > i]), in order of i """
+        previous = None
+        try:
+            for chunk, synsets in self._chunks():
+                block = self.buildRows(np.array(sorted(synsets), dtype=np.intp), previous)
+                for row in self._scoreChunk(chunk, block):
+                    yield row
+
+                previous = block
+        finally:
+            self._closePool()
+
+    def _scoreChunk(self, chunk, block):
+        rows, position = block
+        if self.jobs > 1 and len(chunk) > 1:
+            with ProcessPoolExecutor(max_workers=self.jobs, initializer=_initScoreWorker, initargs=(rows, position, self.vectors, self.index)) as pool:
+                # only a few blocks per job are in flight: when the rows are consumed slower than
+                # they are scored, the results waiting to be consumed stay bounded
+                pending = deque()
+                for block in self._blocks(chunk):
+                    pending.append(pool.submit(_scoreRows, block))
+                    if len(pending) >= self.jobs * BLOCKS_IN_FLIGHT:
+                        for row in pending.popleft().result():
+                            yield row
+
+                while len(pending) > 0:
+                    for row in pending.popleft().result():
+                        yield row
+        else:
+            for i in chunk:
+                yield _scoreOthers(rows, position, self.vectors, self.index, i)
+
+    def countCandidates(self):
+        n = len(self.vectors)
+        if self.index is None:
+            return n * (n - 1) // 2
+
+        return sum(len(self.index.candidates(i)) for i in range(0, n))
+
+class CandidateIndex:
+    """ Inverted index from synsets to the requirements using them. Only the pairs of
+        requirements sharing at least minOverlap of the distinct synsets of the shorter
+        one are candidates for full scoring: lowering minOverlap trades speed for recall """
+
+    def __init__(self, vectors, minOverlap):
+        self.minOverlap = minOverlap
+        self.sets = [set(v.tolist()) for v in vectors]
+        self.postings = {}
+
+        # postings are filled in order, so each list is sorted
+        for i, synsets in enumerate(self.sets):
+            for ss in synsets:
+                self.postings.setdefault(ss, []).append(i)
+
+    def _candidates(self, i, after):
+        shared = {}
+        for ss in self.sets[i]:
+            posting = self.postings[ss]
+            for j in (posting[bisect.bisect_right(posting, i):] if after else posting):
+                shared[j] = shared.get(j, 0) + 1
+
+        size = len(self.sets[i])
+        result = []
+        for j, count in shared.items():
+            if j != i and count >= max(1, math.ceil(self.minOverlap * min(size, len(self.sets[j])))):
+                result.append(j)
+
+        return result
+
+    def candidates(self, i):
+        """ The sorted positions j > i of the candidates for a pair with i """
+        return sorted(self._candidates(i, True))
+
+    def related(self, i):
+        """ The set of positions of all the candidates for a pair with i """
+        return set(self._candidates(i, False))
+
+def _similarityCells(synsets, cells):
+    """ path_similarity for the given (row, columns) cells, -1 when it cannot be computed """
+    values = []
+    for row, columns in cells:
+        value = np.full(len(columns), -1.0)
+        for b, column in enumerate(columns.tolist()):
+            sc = synsets[row].path_similarity(synsets[column])
+            if sc is not None:
+                value[b] = sc
+
+        values.append(value)
+
+    return values
+
+def _scoreRow(synsetRows, vectors, i, others):
+    """ getSimilarity(i, j) for each j in others, synsetRows being the rows of the matrix for the synsets of i """
+    vector = vectors[i]
+    if len(vector) == 0:
+        return [0] * len(others)
+
+    scores = [-1.0] * len(others)
+    scored = [n for n in range(0, len(others)) if len(vectors[others[n]]) > 0]
+    if len(scored) > 0:
+        columns = np.concatenate([vectors[others[n]] for n in scored])
+        offsets = np.cumsum([0] + [len(vectors[others[n]]) for n in scored[:-1]])
+
+        # best match of every synset of i in each of the other sentences
+        best = np.maximum.reduceat(synsetRows[:, columns], offsets, axis=1)
+
+        # accumulate row by row, in the same order as getSimilarity, so the sums are bit for bit identical
+        total = best[0].copy()
+        for row in best[1:]:
+            total += row
+
+        for n, value in zip(scored, (total / len(vector)).tolist()):
+            scores[n] = value
+
+    return scores
+
+def _scoreColumn(synsetColumns, vectors, rows, j):
+    """ _scoreRow the other way round: getSimilarity(i, j) for each i in rows, synsetColumns
+        being the columns of the matrix for the synsets of j """
+    vector = vectors[j]
+    scores = [0] * len(rows)
+    scored = [n for n in range(0, len(rows)) if len(vectors[rows[n]]) > 0]
+    if len(scored) == 0:
+        return scores
+
+    if len(vector) == 0:
+        for n in scored:
+            scores[n] = -1.0
+
+        return scores
+
+    lengths = np.array([len(vectors[rows[n]]) for n in scored])
+    starts = np.cumsum(lengths) - lengths
+
+    # best match in j of every synset of each sentence
+    best = synsetColumns[np.concatenate([vectors[rows[n]] for n in scored])].max(axis=1)
+
+    # accumulate synset by synset, in the same order as getSimilarity
+    total = best[starts].copy()
+    for k in range(1, lengths.max()):
+        longer = lengths > k
+        total[longer] += best[starts[longer] + k]
+
+    for n, value in zip(scored, (total / lengths).tolist()):
+        scores[n] = value
+
+    return scores
+
+def _scoreOthers(rows, position, vectors, index, i):
+    if index is None:
+        others = list(range(i + 1, len(vectors)))
+    else:
+        others = index.candidates(i)
+
+    return (i, list(zip(others, _scoreRow(rows[position[vectors[i]]], vectors, i, others))))
+
+# process pool workers: the shared data is handed over once per worker by the initializer
+
+_worker = {}
+
+def _initMatrixWorker(names):
+    # loads WordNet once in this worker
+    _loadNltk()
+    _worker["synsets"] = [wn.synset(name) for name in names]
+
+def _matrixCells(cells):
+    return _similarityCells(_worker["synsets"], cells)
 
+def _initScoreWorker(rows, position, vectors, index):
+    _worker["rows"] = rows
+    _worker["position"] = position
+    _worker["vectors"] = vectors
+    _worker["index"] = index
 
+def _scoreRows(rows):
+    return [_scoreOthers(_worker["rows"], _worker["position"], _worker["vectors"], _worker["index"], i) for i in rows]
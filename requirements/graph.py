@@ -0,0 +1,95 @@
+import sys
+
+
+
+
+
+class TraceabilityGraph:
+    """ Forward and reverse link index over a set of parsed requirements.
+        Built once after parsing and shared by all the renderers, so that
+        walking the traceability tree never rescans the requirements dict """
+
+    def __init__(self, requirements):
+        self.requirements = requirements
+        self.forward = {}
+        self.reverse = {}
+
+        # rendering order, computed on first use: a sort key per requirement, and
+        # the sorted links of each requirement by (requirement, direction)
+        self.sortKeys = None
+        self.sortedLinks = {}
+
+        self._build()
+
+    def _build(self):
+        # adjacency lists hold interned IDs, so that the same ID linked from
+        # many requirements is stored (and compared) only once
+        for key, req in self.requirements.items():
+            reqID = sys.intern(str(key))
+            links = tuple(sys.intern(str(l)) for l in req.getLinks())
+            self.forward[reqID] = links
+
+            # reverse links are keyed by the category of the linking requirement
+            byCategory = self.reverse.setdefault(req.getCategory(), {})
+            seen = set()
+            for link in links:
+                if link not in seen:
+                    seen.add(link)
+                    byCategory.setdefault(link, []).append(reqID)
+
+    def getLinks(self, reqID):
+        """ The IDs a requirement links to, as found in its Link column """
+        return self.forward.get(reqID, ())
+
+    def getLinkedBy(self, reqID, category):
+        """ The IDs of the requirements of the given category linking to reqID """
+        result = ()
+        if category in self.reverse:
+            result = self.reverse[category].get(reqID, ())
+
+        return result
+
+    def getSortKey(self, reqID):
+        """ The values of the attributes listed by sortOrder in config.yaml, by their order """
+        if self.sortKeys is None:
+            import config
+
+            precedence = config.getSortOrder()
+            keys = {}
+            for key, req in self.requirements.items():
+                attrs = dict( (a.getName(), a) for a in req.getAttributes() )
+                keys[key] = tuple( attrs[name].getOrder() for name in precedence if name in attrs )
+
+            self.sortKeys = keys
+
+        return self.sortKeys[reqID]
+
+    def sortRequirements(self, reqIDs):
+        """ The IDs of the existing requirements among reqIDs, in rendering order """
+        keys = [ key for key in reqIDs if key in self.requirements ]
+        keys.sort(key=self.getSortKey)
+        return [ self.requirements[key].getID() for key in keys ]
+
+    def getSortedLinks(self, reqID):
+        """ getLinks in rendering order, without dangling links """
+        result = self.sortedLinks.get( (reqID, None) )
+        if result is None:
+            result = self.sortedLinks[ (reqID, None) ] = self.sortRequirements(self.getLinks(reqID))
+
+        return result
+
+    def getSortedLinkedBy(self, reqID, category):
+        """ getLinkedBy in rendering order """
+        result = self.sortedLinks.get( (reqID, category) )
+        if result is None:
+            result = self.sortedLinks[ (reqID, category) ] = self.sortRequirements(self.getLinkedBy(reqID, category))
+
+        return result
+
+    def isLinked(self, reqID):
+        """ True if any requirement, of any category, links to reqID """
+        for byCategory in self.reverse.values():
+            if reqID in byCategory:
+                return True
+
+        return False
@@ -0,0 +1,160 @@
+import json
+from xmind import XMindReader, StreamingXMindDocument
+from xmind.reader import SheetRecord
+from xmind.id_gen import qualify_id
+
+
+class MapSummary:
+    """ What a rendered map says about each of its requirements: text, markers and the places
+        (sheet and parent topic) it shows at. Built in a single streaming pass over the map,
+        so only these records are kept in memory, never the trees of topics """
+
+    def __init__(self, filename):
+        self.filename = filename
+        self.requirements = {}
+        self.placements = {}
+
+        self.read()
+
+    @staticmethod
+    def topicKey(topic):
+        """ The key matching a requirement topic across maps: its embedded id if it has one,
+            else the requirement ID on the first line of its note. None for other topics
+            (root, chapters, issue categories and conventions, whose notes are plain text) """
+        key = qualify_id(topic.id)
+        if key is None and topic.note:
+            key = topic.note.split("\n", 1)[0].strip()
+            if key == "" or len(key.split()) > 1:
+                key = None
+
+        return key
+
+    def read(self):
+        # the parent of a topic is read after it, so the keys of the requirements
+        # below a topic wait here for the topic to be read
+        pending = {}
+        titles = {}
+        placements = {}
+
+        with XMindReader(self.filename) as reader:
+            for record in reader.topics(with_sheets=True):
+                if isinstance(record, SheetRecord):
+                    titles[record.id] = record.title
+                    continue
+
+                key = self.topicKey(record)
+                parent = key if key is not None else record.title
+                for child in pending.pop(record.id, []):
+                    placements.setdefault(child, set()).add( (record.sheet_id, parent) )
+
+                if key is None:
+                    continue
+
+                # reference topics (shared subtrees, link cycles) have no markers, the
+                # topic they link to has them
+                if key not in self.requirements or not self.isReference(record):
+                    self.requirements[key] = (record.title, frozenset(record.markers))
+
+                if record.parent_id is not None:
+                    pending.setdefault(record.parent_id, []).append(key)
+
+        for key, places in placements.items():
+            self.placements[key] = set( (titles.get(sheet, ""), parent) for (sheet, parent) in places )
+
+    @staticmethod
+    def isReference(topic):
+        return topic.link is not None and topic.link.startswith("xmind:#")
+
+class MapDiff:
+    """ The requirement topics added, removed, moved (shown under other parents) or whose
+        markers changed between two rendered maps """
+
+    def __init__(self, oldFilename, newFilename):
+        self.oldFilename = oldFilename
+        self.newFilename = newFilename
+
+        old = MapSummary(oldFilename)
+        new = MapSummary(newFilename)
+
+        self.added = sorted(k for k in new.requirements if k not in old.requirements)
+        self.removed = sorted(k for k in old.requirements if k not in new.requirements)
+        self.titles = dict( (k, new.requirements[k][0]) for k in self.added )
+        self.titles.update( (k, old.requirements[k][0]) for k in self.removed )
+
+        self.moved = {}
+        self.markers = {}
+        for key in sorted(k for k in new.requirements if k in old.requirements):
+            oldPlaces = old.placements.get(key, set())
+            newPlaces = new.placements.get(key, set())
+            if oldPlaces != newPlaces:
+                self.moved[key] = (sorted(oldPlaces - newPlaces), sorted(newPlaces - oldPlaces))
+
+            oldMarkers = old.requirements[key][1]
+            newMarkers = new.requirements[key][1]
+            if oldMarkers != newMarkers:
+                self.markers[key] = (sorted(oldMarkers), sorted(newMarkers))
+
+            if key in self.moved or key in self.markers:
+                self.titles[key] = new.requirements[key][0]
+
+    @staticmethod
+    def placeText(place):
+        return "%s / %s" % place
+
+    def toDict(self):
+        return { "old": self.oldFilename, "new": self.newFilename,
+                 "added": [ { "id": k, "title": self.titles[k] } for k in self.added ],
+                 "removed": [ { "id": k, "title": self.titles[k] } for k in self.removed ],
+                 "moved": [ { "id": k, "title": self.titles[k], "from": [ self.placeText(p) for p in f ], "to": [ self.placeText(p) for p in t ] }
+                            for (k, (f, t)) in sorted(self.moved.items()) ],
+                 "markers": [ { "id": k, "title": self.titles[k], "from": f, "to": t }
+                              for (k, (f, t)) in sorted(self.markers.items()) ] }
+
+    def saveJSON(self, filename):
+        with open(filename, "w") as f:
+            json.dump(self.toDict(), f, indent=2)
+
+    def printSummary(self, verbose=False):
+        print("Changes from %s to %s:" % (self.oldFilename, self.newFilename))
+        print("%d requirements added, %d removed, %d moved, %d with changed markers" % (len(self.added), len(self.removed), len(self.moved), len(self.markers)))
+
+        if verbose:
+            for k in self.added:
+                print("  added %s: %s" % (k, self.titles[k]))
+            for k in self.removed:
+                print("  removed %s: %s" % (k, self.titles[k]))
+            for k, (f, t) in sorted(self.moved.items()):
+                print("  moved %s: from %s to %s" % (k, ", ".join(self.placeText(p) for p in f) or "-", ", ".join(self.placeText(p) for p in t) or "-"))
+            for k, (f, t) in sorted(self.markers.items()):
+                print("  markers of %s: from %s to %s" % (k, ", ".join(f) or "-", ", ".join(t) or "-"))
+
+    def render(self, filename):
+        """ Save the changes as a map: a topic for each kind of change, and below it a topic for
+            each requirement, with the details in its note. Written out while it is built, as
+            the changes between two large maps can be many """
+        doc = StreamingXMindDocument.create(u"Changes", u"Changes from %s to %s" % (self.oldFilename, self.newFilename))
+        root = doc.get_first_sheet().get_root_topic()
+
+        group = root.add_subtopic(u"Added (%d)" % len(self.added), folded=True)
+        for k in self.added:
+            topic = group.add_subtopic(self.titles[k])
+            topic.set_note(k)
+
+        group = root.add_subtopic(u"Removed (%d)" % len(self.removed), folded=True)
+        for k in self.removed:
+            topic = group.add_subtopic(self.titles[k])
+            topic.set_note(k)
+
+        group = root.add_subtopic(u"Moved (%d)" % len(self.moved), folded=True)
+        for k, (f, t) in sorted(self.moved.items()):
+            topic = group.add_subtopic(self.titles[k])
+            topic.set_note("%s\nNo longer under:\n%s\nNow under:\n%s" % (k, "\n".join(self.placeText(p) for p in f) or "-", "\n".join(self.placeText(p) for p in t) or "-"))
+
+        group = root.add_subtopic(u"Markers changed (%d)" % len(self.markers), folded=True)
+        for k, (f, t) in sorted(self.markers.items()):
+            topic = group.add_subtopic(self.titles[k])
+            topic.set_note("%s\nMarkers were: %s" % (k, ", ".join(f) or "-"))
+            for marker in t:
+                topic.add_marker(marker)
+
+        doc.save(filename)
@@ -1,5 +1,5 @@
-import excel, xlrd
 from .requirement import Requirement
+from .readers import openReader
 import config
 
 
@@ -7,17 +7,19 @@ import config
 
 
 class Parser:
-    def __init__(self, category, filename, strict, verbose=False):
+    def __init__(self, category, filename, strict, verbose=False, backend=None):
         self.filename = filename
         self.category = category
         self.colNames = {}
         self.verbose = verbose
         self.strict = strict
+        self.backend = backend
 
     def getValue(self, row, value):
+        # rows only hold the mapped columns, in the order of self.colNames
         result = None
-        if value in self.colNames.keys() and (self.colNames[value] is not None):
-            result = row[ self.colNames[value]].value
+        if value in self.rowPositions.keys():
+            result = row[ self.rowPositions[value] ]
 
         return result
 
@@ -35,7 +37,7 @@ class Parser:
         colNameProbes = config.getColNameProbes()
         for name, values in colNameProbes.items():
             for i in range(0, len(row)):
-                if self.checkColName(row[i].value, values):
+                if self.checkColName(row[i], values):
                     self.colNames[name] = i
                     break
 
@@ -43,15 +45,16 @@ class Parser:
             print("The column indexes are: %s" % (str(self.colNames)))
 
     def parse(self):
+        reader = openReader(self.filename, self.backend)
         try:
-            f=excel.OpenExcel(self.filename)
-        except xlrd.biffh.XLRDError as e:
-            print("WARNING: You may need to close Excel if you have it open")
-            raise e
+            result = self._parseRows(reader)
+        finally:
+            reader.close()
 
-        sheet=f.read()
+        return result
+
+    def _parseRows(self, reader):
         reqs={}
-        counter=0
         reqCounter=0
         nolinks = []
         duplicates=[]
@@ -60,44 +63,42 @@ class Parser:
         currentChapter = { 'name': "Default", "category": self.category, 'reqs': []}
 
         # row #0 contains the headers
-        for row in sheet.get_rows():
-            # rows without a reqID are not requirements
-            if counter == 0:
-                self.parseColNames(row)
-            else:
-                reqID = self.getValue(row, "CodeName")
-                if len(reqID) > 1:
+        self.parseColNames(reader.header())
+        self.rowPositions = dict( (name, i) for i, name in enumerate(self.colNames.keys()) )
 
-                    attributes = {}
-                    for name in self.colNames.keys():
-                        val = self.getValue(row, name)
-                        attributes[name] = val
+        for row in reader.rows(list(self.colNames.values())):
+            # rows without a reqID are not requirements
+            reqID = self.getValue(row, "CodeName")
+            if len(reqID) > 1:
 
-                    essentialValues = attributes.keys()
-                    if ("ID" not in essentialValues) or ("CodeName" not in essentialValues) or ("Requirement" not in essentialValues) or ("Link" not in essentialValues):
-                        raise Exception("To parse requirements properly, all essential attributes ('ID', 'CodeName', 'Requirement' and 'Link') must be provided in each requirement, while these values were found in file %s: %s" % (self.filename, str(attributes)))
+                attributes = {}
+                for name in self.colNames.keys():
+                    val = self.getValue(row, name)
+                    attributes[name] = val
 
-                    r = Requirement(self.category, self.strict, attributes)
+                essentialValues = attributes.keys()
+                if ("ID" not in essentialValues) or ("CodeName" not in essentialValues) or ("Requirement" not in essentialValues) or ("Link" not in essentialValues):
+                    raise Exception("To parse requirements properly, all essential attributes ('ID', 'CodeName', 'Requirement' and 'Link') must be provided in each requirement, while these values were found in file %s: %s" % (self.filename, str(attributes)))
 
-                    # Some integrity checks
-                    if len(r.getLinks()) == 0 and self.category != "system":
-                        nolinks.append( str(r.getID()) )
+                r = Requirement(self.category, self.strict, attributes)
 
-                    if r.getID() in reqs.keys():
-                        duplicates.append( str(r.getID()) )
-                        if self.verbose:
-                            print("WARNING: duplicate requirement ID.\n%s\n%s\n" % ( r, reqs[r.getID()]))
+                # Some integrity checks
+                if len(r.getLinks()) == 0 and self.category != "system":
+                    nolinks.append( str(r.getID()) )
 
-                    # let's add it finally!
-                    reqs[r.getID()] = r
-                    currentChapter['reqs'].append( str(r.getID()) )
-                    reqCounter = reqCounter + 1
-                else:
-                    if len(currentChapter['reqs']) > 0:
-                        chapters.append(currentChapter)
-                    currentChapter = { "name": self.getValue(row, "Requirement"), "category":self.category, "reqs": []}
+                if r.getID() in reqs.keys():
+                    duplicates.append( str(r.getID()) )
+                    if self.verbose:
+                        print("WARNING: duplicate requirement ID.\n%s\n%s\n" % ( r, reqs[r.getID()]))
 
-            counter = counter+1
+                # let's add it finally!
+                reqs[r.getID()] = r
+                currentChapter['reqs'].append( str(r.getID()) )
+                reqCounter = reqCounter + 1
+            else:
+                if len(currentChapter['reqs']) > 0:
+                    chapters.append(currentChapter)
+                currentChapter = { "name": self.getValue(row, "Requirement"), "category":self.category, "reqs": []}
 
         # close the last chapter
         if len(currentChapter['reqs']) > 0:
@@ -116,3 +117,6 @@ class Parser:
 
         return (chapters, reqs, [nolinks, duplicates ])
 
+def parseFile(category, filename, strict, verbose=False, backend=None):
+    """ Parse a single source file. Module level, so that it can be run in a process pool """
+    return Parser(category, filename, strict, verbose, backend).parse()
@@ -0,0 +1,73 @@
+import config
+
+
+
+
+
+class ExcelReader:
+    """ Reads the whole first sheet of a workbook through xlrd (the original parser backend) """
+
+    def __init__(self, filename):
+        import excel, xlrd
+
+        try:
+            self.sheet = excel.OpenExcel(filename).read()
+        except xlrd.biffh.XLRDError as e:
+            print("WARNING: You may need to close Excel if you have it open")
+            raise e
+
+    def header(self):
+        return [cell.value for cell in self.sheet.row(0)] if self.sheet.nrows > 0 else []
+
+    def rows(self, columns):
+        for i in range(1, self.sheet.nrows):
+            row = self.sheet.row(i)
+            yield tuple(row[c].value if c < len(row) else "" for c in columns)
+
+    def close(self):
+        pass
+
+class StreamingReader:
+    """ Reads the first sheet of a workbook lazily, one row at a time, through openpyxl
+        in read-only mode. Only the cells in the span of the requested columns are
+        loaded, so memory stays flat whatever the number of rows """
+
+    def __init__(self, filename):
+        import openpyxl
+
+        self.workbook = openpyxl.load_workbook(filename, read_only=True, data_only=True)
+        self.sheet = self.workbook.worksheets[0]
+
+    @staticmethod
+    def _value(value):
+        # xlrd reports empty cells as empty strings, the parser relies on it
+        return "" if value is None else value
+
+    def header(self):
+        for row in self.sheet.iter_rows(min_row=1, max_row=1, values_only=True):
+            return [StreamingReader._value(v) for v in row]
+
+        return []
+
+    def rows(self, columns):
+        if len(columns) == 0:
+            return
+
+        first = min(columns)
+        offsets = [c - first for c in columns]
+        for row in self.sheet.iter_rows(min_row=2, min_col=first + 1, max_col=max(columns) + 1, values_only=True):
+            yield tuple(StreamingReader._value(row[o]) if o < len(row) else "" for o in offsets)
+
+    def close(self):
+        self.workbook.close()
+
+backends = { "excel": ExcelReader, "streaming": StreamingReader }
+
+def openReader(filename, backend=None):
+    if backend is None:
+        backend = config.getParserBackend()
+
+    if backend not in backends.keys():
+        raise Exception("Unknown parser backend '%s', should be one of: %s" % (backend, ", ".join(backends.keys())))
+
+    return backends[backend](filename)
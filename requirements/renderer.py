@@ -1,7 +1,10 @@
-import os
-from xmind import XMindDocument
+import os, tempfile
+from xmind import XMindDocument, StreamingXMindDocument
 from xmind.document import SHAPE_RECTANGLE, SHAPE_ROUND_RECTANGLE, SHAPE_ELLIPSIS
-from requirements import Attribute
+from .requirement import Attribute
+from .graph import TraceabilityGraph
+from .analysis import TraceabilityAnalysis
+from .sheetcache import SheetCache, requirementInputs
 
 import config
 
@@ -14,9 +17,13 @@ class AttributeNotRenderable(Exception):
     pass
 
 class AttributeRenderer:
-    markers = config.getAttributeMarkers()
+    # read from the configuration when the first attribute is rendered
+    markers = None
 
     def __init__(self, attr):
+        if AttributeRenderer.markers is None:
+            AttributeRenderer.markers = config.getAttributeMarkers()
+
         if not attr.isValid():
             raise AttributeNotRenderable("Attribute '%s' with value '%s' is not valid" % (attr.getName(), attr.getValue()))
 
@@ -31,14 +38,25 @@ class AttributeRenderer:
         return AttributeRenderer.markers[self.attribute.getName()][order]
 
 class Renderer:
-    def __init__(self, chapters, requirements, doc=None, renderOrphans=True, renderFolded=True, maxDepth=999, verbose=False):
+    def __init__(self, chapters, requirements, doc=None, renderOrphans=True, renderFolded=True, maxDepth=999, verbose=False, graph=None, analysis=None, streaming=False, compressLevel=0, jobs=1, shareSubtrees=False):
         self.requirements = requirements
+        self.shareSubtrees = shareSubtrees
+        self.compressLevel = compressLevel
+        self.jobs = jobs
+        self.graph = graph
+        if self.graph is None:
+            self.graph = TraceabilityGraph(requirements)
+
+        self.analysis = analysis
+        if self.analysis is None:
+            self.analysis = TraceabilityAnalysis(requirements, self.graph)
+
         self.verbose = verbose
         self.chapters = chapters
         self.maxDepth = maxDepth
         self.xmindDoc = doc
         if self.xmindDoc is None:
-            self.xmindDoc = XMindDocument.create(u"ReqTrees", u"text")
+            self.xmindDoc = Renderer.createDocument(streaming)
 
         self.levelsProgression = ['system', 'user', 'business']
 
@@ -54,7 +72,16 @@ class Renderer:
         else:
             self.topicStyle = self.xmindDoc.get_styles()
 
-        self.issues = []
+        # link cycles met while rendering, by their requirement IDs
+        self.cycles = {}
+
+    @staticmethod
+    def createDocument(streaming=False):
+        # a streaming document writes topics out as they are rendered, instead of keeping the whole map in memory
+        if streaming:
+            return StreamingXMindDocument.create(u"ReqTrees", u"text")
+
+        return XMindDocument.create(u"ReqTrees", u"text")
 
     @staticmethod
     def setupStyle(xmindDoc, what):
@@ -86,12 +113,15 @@ class Renderer:
         if self._renderOrphans:
             self.renderOrphans(rootTopic)
             self.renderNoLinks(rootTopic)
+            self.renderDanglingLinks(rootTopic)
+            self.renderCycles(rootTopic)
 
         if sheet is None:
-            self.xmindDoc.save(filename)
+            self.xmindDoc.save(filename, compress_level=self.compressLevel, threads=self.jobs)
 
     def renderContent(self, rootSheet, category ):
         self.attributeIssues = {}
+        self.renderedTopics = {}
         rootTopic = rootSheet.get_root_topic()
 
         for chapter in self.chapters:
@@ -105,22 +135,7 @@ class Renderer:
 
     def renderOrphans(self, rootTopic):
         for cat in self.levelsProgression[:-1]: # skip the business requirements
-            orphans = []
-            for key, req in self.requirements.items():
-                if req.getCategory() == cat:
-                    found = False
-                    for key2, req2 in self.requirements.items():
-                        for link in self.getNextLevel(req2):
-                            if link == req.getID():
-                                found = True
-                                break
-
-                        if found:
-                            break
-
-                    if not found and (key not in orphans):
-                        orphans.append(key)
-
+            orphans = self.analysis.getOrphans(cat)
             if len(orphans) > 0:
                 topic = rootTopic.add_subtopic("Orphaned %s Requirements" % cat )
                 for key in orphans:
@@ -129,17 +144,33 @@ class Renderer:
 
     def renderNoLinks(self, rootTopic):
         for cat in self.levelsProgression[1:]:   # skip the system requirements
-            orphans = []
-            for key, req in self.requirements.items():
-                if req.getCategory() == cat and len(req.getLinks()) == 0:
-                    orphans.append(key)
-
+            orphans = self.analysis.getNoLinks(cat)
             if len(orphans) > 0:
                 topic = rootTopic.add_subtopic("%s Requirements without links" % cat )
                 for key in orphans:
                     req = self.requirements[key]
                     self.createTopic(topic, req)
 
+    def renderDanglingLinks(self, rootTopic):
+        dangling = self.analysis.getDanglingLinks()
+        if len(dangling) > 0:
+            topic = rootTopic.add_subtopic("Requirements with dangling links")
+            sources = {}
+            for source, target in dangling:
+                if source not in sources:
+                    sources[source] = self.createTopic(topic, self.requirements[source])
+
+                sources[source].add_subtopic("Missing requirement %s" % target)
+
+    def renderCycles(self, rootTopic):
+        cycles = self.analysis.getCycles()
+        if len(cycles) > 0:
+            topic = rootTopic.add_subtopic("Requirements in link cycles")
+            for cycle in cycles:
+                cycleTopic = topic.add_subtopic("Link cycle between %d requirement(s)" % len(cycle))
+                for key in cycle:
+                    self.createTopic(cycleTopic, self.requirements[key])
+
     def createTopic(self, root, requirement):
         newTopic = root.add_subtopic(requirement.getText(), folded=self.renderFolded)
         self.setStyle(requirement, newTopic)
@@ -160,42 +191,140 @@ class Renderer:
 
         return newTopic
 
+    def createReferenceTopic(self, root, requirement, topicID):
+        # stands for a requirement whose subtree is rendered in full elsewhere in the sheet, and links to it
+        newTopic = root.add_subtopic(requirement.getText(), folded=self.renderFolded)
+        self.setStyle(requirement, newTopic)
+        newTopic.set_note("%s\nSee the linked topic for the subtree of this requirement" % requirement.getID())
+        newTopic.set_link("xmind:#%s" % topicID)
+
+        return newTopic
+
     # sort the links attributed to a requirement.
-    # use the 3 attributes priority, risk and difficulty
+    # use the attributes in the sortOrder of config.yaml (by default priority, risk and difficulty),
+    # the keys are computed once by the graph and shared by all the renderers
     def sortLinks(self, reqList):
-        reqs = []
-        for l in reqList:
-          r = self.getLinkedRequirement(l)
-          if r is not None:
-              reqs.append(r)
-
-        def reqOrder(req):
-            order = []
-            attrs = req.getAttributes()
-            for attributeOrder in ['Priority', 'Risk', 'Difficulty']:
-                for attribute in attrs:
-                    if attribute.getName() == attributeOrder:
-                       order.append( attribute.getOrder() )
-                       break
-
-            return order
-
-        reqs.sort(key=reqOrder)
-        return [x.getID() for x in reqs]
-
-    def renderTopic(self, root, rootTopic, link ):
-        linked = self.getLinkedRequirement(link)
-        valid = (linked is not None )  # do we have valid links (consdiering the asymmetry between business and system)?
-
-        if valid:
-            newTopic = self.createTopic(rootTopic, linked)
-            children = self.sortLinks(self.getNextLevel(linked))
-            for l in children:
-                self.renderTopic(linked, newTopic, l)
-
+        return self.graph.sortRequirements(reqList)
+
+    def recordCycle(self, cycle):
+        # the same cycle is met from each of its requirements, keep it once
+        start = cycle.index(min(cycle))
+        key = tuple(cycle[start:] + cycle[:start])
+        if key not in self.cycles:
+            self.cycles[key] = cycle
+            if self.verbose:
+                print("WARNING: link cycle %s" % " -> ".join(cycle + [cycle[0]]))
+
+    def renderTopic(self, root, rootTopic, link, depth=1 ):
+        # depth first, with an explicit stack so that deep or cyclic links cannot exhaust the
+        # python stack. None entries mark the end of the subtree of the last requirement of path
+        path = []       # (requirement ID, topic ID) from the first rendered requirement down
+        onPath = set()
+        stack = [ (rootTopic, link, depth) ]
+
+        while len(stack) > 0:
+            entry = stack.pop()
+            if entry is None:
+                onPath.discard(path.pop()[0])
+                continue
+
+            (parentTopic, link, depth) = entry
+            linked = self.getLinkedRequirement(link)
+            if linked is None:  # do we have valid links (consdiering the asymmetry between business and system)?
+                continue
+
+            reqID = linked.getID()
+
+            # a link back to a requirement of the path closes a cycle: stop there with a reference to it
+            if reqID in onPath:
+                ids = [i for i, topicID in path]
+                start = ids.index(reqID)
+                self.recordCycle(ids[start:])
+                self.createReferenceTopic(parentTopic, linked, path[start][1])
+                continue
+
+            # when sharing subtrees, each requirement is rendered in full once per sheet, later
+            # occurrences are references to it: the map stays linear in size
+            if self.shareSubtrees and reqID in self.renderedTopics:
+                self.createReferenceTopic(parentTopic, linked, self.renderedTopics[reqID])
+                continue
+
+            newTopic = self.createTopic(parentTopic, linked)
+            if self.shareSubtrees:
+                self.renderedTopics[reqID] = newTopic.get_id()
+
+            if depth < self.maxDepth:
+                children = self.getNextLevel(linked)
+                if len(children) > 0:
+                    path.append( (reqID, newTopic.get_id()) )
+                    onPath.add(reqID)
+                    stack.append(None)
+                    for l in reversed(children):
+                        stack.append( (newTopic, l, depth + 1) )
+
+    # the IDs of the requirements below requirement in the tree, in rendering order
     def getNextLevel(self, requirement):
         pass
 
+    # the category of the requirements at the root of the trees
+    def getRootCategory(self):
+        pass
+
+    def countTopics(self, reqID, counts):
+        """ The number of topics in the tree of reqID, counts holding the ones already known. Link
+            cycles count once and maxDepth is ignored, so with shareSubtrees it is an upper bound """
+        stack = [ (reqID, False) ]
+        while len(stack) > 0:
+            key, expanded = stack.pop()
+            if key in counts and not expanded:
+                continue
+
+            children = self.getNextLevel(self.getLinkedRequirement(key))
+            if expanded:
+                counts[key] = 1 + sum(counts[child] for child in children)
+            else:
+                # a link back to key before it is counted closes a cycle: one topic
+                counts[key] = 1
+                stack.append( (key, True) )
+                stack.extend( (child, False) for child in children if child not in counts )
+
+        return counts[reqID]
+
+    def treeInputs(self):
+        """ What the requirement trees depend on: the chapters they start from and all the
+            requirements reachable from them, in the order they are rendered and each with its
+            children in that order, plus the rendering flags (see SheetCache) """
+        category = self.getRootCategory()
+        chapters = [ [chapter['name'], self.sortLinks(chapter['reqs'])] for chapter in self.chapters if chapter['category'] == category and len(chapter['reqs']) > 0 ]
+
+        reachable = []
+        seen = set()
+        pending = [ reqID for name, reqs in reversed(chapters) for reqID in reversed(reqs) ]
+        while len(pending) > 0:
+            reqID = pending.pop()
+            if reqID not in seen:
+                seen.add(reqID)
+                req = self.getLinkedRequirement(reqID)
+                children = list(self.getNextLevel(req))
+                reachable.append( [ requirementInputs(req), children ] )
+                pending.extend(reversed(children))
+
+        return [ type(self).__name__, self.renderFolded, self.maxDepth, self.shareSubtrees, chapters, reachable ]
+
+    def issuesInputs(self):
+        """ What the rendered issues depend on (see SheetCache) """
+        orphans = [ self.analysis.getOrphans(cat) for cat in self.levelsProgression[:-1] ]
+        nolinks = [ self.analysis.getNoLinks(cat) for cat in self.levelsProgression[1:] ]
+        dangling = [ list(d) for d in self.analysis.getDanglingLinks() ]
+        cycles = self.analysis.getCycles()
+
+        involved = set(source for source, target in dangling)
+        for keys in orphans + nolinks + cycles:
+            involved.update(keys)
+
+        return [ "issues", self.renderFolded, orphans, nolinks, dangling, cycles,
+                 [ requirementInputs(self.requirements[key]) for key in sorted(involved) ] ]
+
     def getLinkedRequirement(self, link):
         req = None
         if link in self.requirements.keys():
@@ -208,6 +337,9 @@ class BottomUpRenderer(Renderer):
         rootSheet.set_title(u"BottomUp" )
         rootTopic.set_title(u"BottomUp Requirements tree" )
 
+        return self.getRootCategory()
+
+    def getRootCategory(self):
         return self.levelsProgression[0]
 
     def getNextLevel(self, requirement):
@@ -215,9 +347,7 @@ class BottomUpRenderer(Renderer):
         for i in range(0, len(self.levelsProgression)):
             if requirement.getCategory() == self.levelsProgression[i] and i< (len(self.levelsProgression) - 1):
                 category = self.levelsProgression[i+1]
-                for reqID, req in self.requirements.items():
-                    if req.getCategory() == category and requirement.getID() in req.getLinks():
-                        links.append(reqID)
+                links.extend(self.graph.getSortedLinkedBy(requirement.getID(), category))
 
         return links
 
@@ -226,14 +356,40 @@ class TopDownRenderer(Renderer):
         rootSheet.set_title(u"TopDown" )
         rootTopic.set_title(u"TopDown Requirements tree" )
 
+        return self.getRootCategory()
+
+    def getRootCategory(self):
         return self.levelsProgression[-1]
 
     def getNextLevel(self, requirement):
-        return requirement.getLinks()
+        return self.graph.getSortedLinks(requirement.getID())
+
+# the renderer of a worker process, when the sheets of a unified map are rendered in parallel
+_sheetRenderer = None
+
+def _initSheetWorker(args, kwargs):
+    global _sheetRenderer
+    _sheetRenderer = UnifiedRenderer(*args, **kwargs)
+
+def _renderSheet(name, key, directory):
+    _sheetRenderer.renderSheet(name, key, SheetCache(directory))
 
 class UnifiedRenderer:
-    def __init__(self, chapters, requirements, renderFolded=True, maxDepth=999, verbose=False):
-        self.xmindDoc = XMindDocument.create(u"ReqTrees", u"text")
+    def __init__(self, chapters, requirements, renderFolded=True, maxDepth=999, verbose=False, graph=None, analysis=None, streaming=False, compressLevel=0, jobs=1, shareSubtrees=False, sheetCache=None):
+        self.compressLevel = compressLevel
+        self.jobs = jobs
+        self.sheetCache = sheetCache
+        if graph is None:
+            graph = TraceabilityGraph(requirements)
+
+        if analysis is None:
+            analysis = TraceabilityAnalysis(requirements, graph)
+
+        # what a worker process needs to render the same sheets
+        self.arguments = ( (chapters, requirements), { "renderFolded": renderFolded, "maxDepth": maxDepth, "verbose": verbose, "graph": graph,
+                           "analysis": analysis, "streaming": streaming, "shareSubtrees": shareSubtrees } )
+
+        self.xmindDoc = Renderer.createDocument(streaming)
         self.topicStyle = {}
 
         self.topicStyle['unknown'] = Renderer.setupStyle(self.xmindDoc, "unknown")
@@ -241,32 +397,92 @@ class UnifiedRenderer:
         self.topicStyle['user'] = Renderer.setupStyle(self.xmindDoc, "user")
         self.topicStyle['system'] = Renderer.setupStyle(self.xmindDoc, "system")
 
-        self.topdown = TopDownRenderer(chapters, requirements, doc=self.xmindDoc, renderOrphans=False, renderFolded=True, maxDepth=maxDepth, verbose=verbose)
-        self.bottomup = BottomUpRenderer(chapters, requirements, doc=self.xmindDoc, renderOrphans=False, renderFolded=True, maxDepth=maxDepth, verbose=verbose)
+        self.topdown = TopDownRenderer(chapters, requirements, doc=self.xmindDoc, renderOrphans=False, renderFolded=True, maxDepth=maxDepth, verbose=verbose, graph=graph, analysis=analysis, shareSubtrees=shareSubtrees)
+        self.bottomup = BottomUpRenderer(chapters, requirements, doc=self.xmindDoc, renderOrphans=False, renderFolded=True, maxDepth=maxDepth, verbose=verbose, graph=graph, analysis=analysis, shareSubtrees=shareSubtrees)
 
-    def render(self, filename ):
+    def sheets(self):
+        # the sheets of the map, in order: (name, sheet title, root topic title, what the sheet depends on, how to render it)
+        return [ ("TopDown", u"ReqTrees", u"text", self.topdown.treeInputs, lambda sheet: self.topdown.render(None, sheet=sheet)),
+                 ("BottomUp", u"ReqTrees", u"text", self.bottomup.treeInputs, lambda sheet: self.bottomup.render(None, sheet=sheet)),
+                 ("Issues", u"Issues", u"Issues", self.topdown.issuesInputs, lambda sheet: self.renderIssues(sheet.get_root_topic())),
+                 # the XMind legend creation does not seem to work properly anymore, so we create a dedicated sheet with all info
+                 ("Conventions", u"Conventions", u"Conventions", lambda: [ "conventions" ], lambda sheet: self.renderLegend(sheet.get_root_topic())) ]
 
-        # topdown is the first sheet
-        sheet = self.xmindDoc.get_first_sheet()
-        self.topdown.render(None, sheet=sheet )
+    def render(self, filename ):
+        if self.sheetCache is not None:
+            self.renderFragments(self.sheetCache, filename)
 
-        # bottomup is the first sheet
-        newsheet = self.xmindDoc.create_sheet(u"ReqTrees", u"text")
-        self.bottomup.render(None, sheet=newsheet)
+        elif self.jobs > 1:
+            # sheets rendered in parallel are assembled from fragments too, through a throwaway cache
+            with tempfile.TemporaryDirectory() as directory:
+                self.renderFragments(SheetCache(directory), filename, reuse=False)
+                self.xmindDoc.save(filename, compress_level=self.compressLevel, threads=self.jobs)
+                return
 
-        # now render orphans
-        newsheet = self.xmindDoc.create_sheet(u"Issues", u"Issues")
-        root = newsheet.get_root_topic()
-        self.topdown.renderOrphans(root)
-        self.topdown.renderNoLinks(root)
+        else:
+            for n, (name, title, rootTitle, inputs, render) in enumerate(self.sheets()):
+                # topdown is the first sheet, created with the document
+                if n == 0:
+                    sheet = self.xmindDoc.get_first_sheet()
+                else:
+                    sheet = self.xmindDoc.create_sheet(title, rootTitle)
 
-        # add a legend. the XMind legend creation does not seem to work properly anymore, so we create a dedicated sheet with all info
-        newsheet = self.xmindDoc.create_sheet(u"Conventions", u"Conventions")
-        root = newsheet.get_root_topic()
-        self.renderLegend(root)
+                render(sheet)
 
         # save our precious work!
-        self.xmindDoc.save(filename)
+        self.xmindDoc.save(filename, compress_level=self.compressLevel, threads=self.jobs)
+
+    def renderFragments(self, cache, filename, reuse=True):
+        # each sheet is only rendered if its inputs changed since it was cached, the document splices
+        # the cached ones in when saving. sheets are rendered in their own block of topic identifiers,
+        # so that they never clash with the ones of the cached sheets
+        self.xmindDoc.remove_sheet(self.xmindDoc.get_first_sheet())
+
+        # the inputs of the sheets are only worth hashing when the cache outlives this render
+        sheets = self.sheets()
+        if reuse:
+            keys = [ cache.key(inputs()) for name, title, rootTitle, inputs, render in sheets ]
+        else:
+            keys = [ cache.key([ name ]) for name, title, rootTitle, inputs, render in sheets ]
+
+        missing = []
+        for (name, title, rootTitle, inputs, render), key in zip(sheets, keys):
+            if cache.has(key):
+                print("Using cached %s sheet" % name)
+            else:
+                missing.append( (name, key) )
+
+        if self.jobs > 1 and len(missing) > 1:
+            from concurrent.futures import ProcessPoolExecutor
+
+            # the workers share nothing but the read-only requirements, each one writes its sheets to the cache
+            with ProcessPoolExecutor(max_workers=min(self.jobs, len(missing)), initializer=_initSheetWorker, initargs=self.arguments) as pool:
+                for result in [ pool.submit(_renderSheet, name, key, cache.directory) for name, key in missing ]:
+                    result.result()
+        else:
+            for name, key in missing:
+                self.renderSheet(name, key, cache)
+
+        for key in keys:
+            self.xmindDoc.add_sheet_fragment(cache.path(key))
+
+        if reuse:
+            cache.prune(filename, keys)
+
+    def renderSheet(self, name, key, cache):
+        for sheetName, title, rootTitle, inputs, render in self.sheets():
+            if sheetName == name:
+                with self.xmindDoc.id_block("cfcf%s" % key[:12]):
+                    sheet = self.xmindDoc.create_sheet(title, rootTitle)
+                    render(sheet)
+
+                cache.store(key, lambda output: self.xmindDoc.write_sheet(sheet, output))
+
+    def renderIssues(self, root):
+        self.topdown.renderOrphans(root)
+        self.topdown.renderNoLinks(root)
+        self.topdown.renderDanglingLinks(root)
+        self.topdown.renderCycles(root)
 
     def renderLegend(self, root):
         # render topic styles legend
@@ -295,7 +511,7 @@ class UnifiedRenderer:
                 m = rootType.add_subtopic(descr)
                 m.add_marker(levelvalue)
 
-        # render orphans + nolinks
+        # render orphans + nolinks + dangling links
         rootIssues = root.add_subtopic("Requirements Issues", folded=False)
         orphans = rootIssues.add_subtopic("Orphans: requirements that are not linked by any other requirement")
         orphans.set_style(self.topicStyle['unknown'])
@@ -305,6 +521,14 @@ class UnifiedRenderer:
         nolinks.set_style(self.topicStyle['unknown'])
         nolinks.set_note("If a business requirement is not linked to any other requirement, the conclusion is that the requirement is NOT going to be implemented. In other words, any business requirement that is not linked to other (user) requirement results in a need that will not be addressed by the project. This situation should be avoided as much as possible: each business requirement is expected to have at least one link.\n If a user requirement has no link to any system requirement, this implies that, while there is a business need that was converted into a user requirement, this will not be implemented. This situation should be avoided as much as possible: each user requirement is expected to be linked to at least one system requirement.")
 
+        dangling = rootIssues.add_subtopic("Dangling links: requirements that link to a requirement that does not exist")
+        dangling.set_style(self.topicStyle['unknown'])
+        dangling.set_note("A link pointing to a requirement ID that cannot be found in any of the sources is usually a typo in the Link column, or a reference to a requirement that was removed. Each dangling link is shown under the requirement that contains it.")
+
+        cycles = rootIssues.add_subtopic("Link cycles: requirements that link, directly or not, to themselves")
+        cycles.set_style(self.topicStyle['unknown'])
+        cycles.set_note("Links are expected to go from business to user to system requirements. A requirement that links to itself, or a chain of links that leads back to where it started, makes traceability ambiguous: in the trees, the link closing the cycle is shown as a topic linking back to the requirement it points to.")
+
         # render traceability
         rootTrace = root.add_subtopic("Requirements traceability", folded=False)
         orphans = rootTrace.add_subtopic("TopDown: from business requirements down to system requirements traceability")
@@ -313,3 +537,119 @@ class UnifiedRenderer:
         nolinks = rootTrace.add_subtopic("BottmUp: from system requirements up to business requirements traceability")
         nolinks.set_style(self.topicStyle['unknown'])
 
+# the requirements and options of a worker process, when the shards of a map are rendered in parallel
+_shardData = None
+
+def _initShardWorker(requirements, options):
+    global _shardData
+    _shardData = (requirements, options)
+
+def _renderShard(rendererClass, chapters, filename):
+    (requirements, options) = _shardData
+    r = rendererClass(chapters, requirements, **options)
+    r.render(filename)
+
+# the topics of a shard sheet besides the requirement trees: the root and the chapter
+SHARD_OVERHEAD = 2
+
+class ShardedRenderer(UnifiedRenderer):
+    """ Splits a map too large for XMind into several files: a top-down map for each business
+        chapter and a bottom-up map for each system chapter, chapters with more topics than
+        the budget being split further by requirement. An index map links to all of them, and
+        holds the Issues and Conventions sheets """
+
+    def __init__(self, chapters, requirements, topicBudget, renderFolded=True, maxDepth=999, verbose=False, graph=None, analysis=None, streaming=False, compressLevel=0, jobs=1, shareSubtrees=False):
+        UnifiedRenderer.__init__(self, chapters, requirements, renderFolded=renderFolded, maxDepth=maxDepth, verbose=verbose, graph=graph, analysis=analysis,
+                                 streaming=streaming, compressLevel=compressLevel, jobs=jobs, shareSubtrees=shareSubtrees)
+        self.requirements = requirements
+        self.topicBudget = topicBudget
+
+    def shards(self, renderer):
+        # [ (name, chapter holding part of the requirements of a chapter, topics) ], for the trees of renderer
+        shards = []
+        counts = {}
+        for chapter in renderer.chapters:
+            if chapter['category'] != renderer.getRootCategory() or len(chapter['reqs']) == 0:
+                continue
+
+            parts = [ [ [], SHARD_OVERHEAD ] ]
+            for reqID in renderer.sortLinks(chapter['reqs']):
+                topics = renderer.countTopics(reqID, counts)
+                if SHARD_OVERHEAD + topics > self.topicBudget:
+                    print("WARNING: requirement %s of chapter %s alone has %d topics, more than the budget of %d" % (reqID, chapter['name'], SHARD_OVERHEAD + topics, self.topicBudget))
+
+                if parts[-1][1] + topics > self.topicBudget and len(parts[-1][0]) > 0:
+                    parts.append( [ [], SHARD_OVERHEAD ] )
+
+                parts[-1][0].append(reqID)
+                parts[-1][1] += topics
+
+            for n, (reqs, topics) in enumerate(parts):
+                name = chapter['name']
+                if len(parts) > 1:
+                    name = "%s (%d/%d)" % (name, n + 1, len(parts))
+
+                shards.append( (name, { 'category': chapter['category'], 'name': name, 'reqs': reqs }, topics) )
+
+        return shards
+
+    def render(self, filename ):
+        base = filename
+        if base.endswith(".xmind"):
+            base = base[:-len(".xmind")]
+
+        (args, options) = self.arguments
+        options = dict(options, compressLevel=self.compressLevel, renderOrphans=False)
+
+        work = []
+        index = []
+        for renderer, rendererClass, kind in [ (self.topdown, TopDownRenderer, "topdown"), (self.bottomup, BottomUpRenderer, "bottomup") ]:
+            shards = []
+            for n, (name, chapter, topics) in enumerate(self.shards(renderer)):
+                shardFile = "%s-%s-%03d.xmind" % (base, kind, n + 1)
+                work.append( (rendererClass, [ chapter ], shardFile) )
+                shards.append( (name, chapter, topics, shardFile) )
+
+            index.append( (kind, shards) )
+
+        if self.jobs > 1 and len(work) > 1:
+            from concurrent.futures import ProcessPoolExecutor
+
+            # the shards are separate documents: each worker renders and saves its own
+            with ProcessPoolExecutor(max_workers=min(self.jobs, len(work)), initializer=_initShardWorker, initargs=(self.requirements, dict(options, jobs=1))) as pool:
+                for result in [ pool.submit(_renderShard, *w) for w in work ]:
+                    result.result()
+        else:
+            _initShardWorker(self.requirements, dict(options, jobs=self.jobs))
+            for w in work:
+                _renderShard(*w)
+
+        for rendererClass, chapters, shardFile in work:
+            print("Rendered to %s" % shardFile)
+
+        self.renderIndex(index)
+
+        # the index holds the issues and the conventions as well
+        for name, title, rootTitle, inputs, render in self.sheets()[2:]:
+            render(self.xmindDoc.create_sheet(title, rootTitle))
+
+        self.xmindDoc.save(filename, compress_level=self.compressLevel, threads=self.jobs)
+
+    def renderIndex(self, index):
+        sheet = self.xmindDoc.get_first_sheet()
+        sheet.set_title(u"Index")
+        root = sheet.get_root_topic()
+        root.set_title(u"Requirements maps")
+
+        titles = { "topdown": ("TopDown requirements trees", 'business'), "bottomup": ("BottomUp requirements trees", 'system') }
+        for kind, shards in index:
+            (title, style) = titles[kind]
+            kindTopic = root.add_subtopic(title, folded=False)
+            kindTopic.set_style(self.topicStyle[style])
+
+            for name, chapter, topics, shardFile in shards:
+                # links are relative, the shards being saved next to the index
+                topic = kindTopic.add_subtopic(name, folded=True)
+                topic.set_style(self.topicStyle[style])
+                topic.set_note("%d requirements, about %d topics\n%s" % (len(chapter['reqs']), topics, os.path.basename(shardFile)))
+                topic.set_link("file:%s" % os.path.basename(shardFile))
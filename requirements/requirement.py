@@ -1,3 +1,4 @@
+import sys
 import config
 
 
@@ -5,19 +6,51 @@ class InvalidAttribute(Exception):
     pass
 
 class Attribute:
-    attributes = config.getPredefinedValueAttributes()
-    fixes = config.getPredefinedValueAttributeFixes()
-    defaults = config.getPredefinedValueAttributeDefaults()
+    # the value is kept as its ordinal in the configured "values" list of the attribute
+    __slots__ = ('name', 'strict', 'order')
+
+    # read from the configuration by loadConfig(), when the first attribute is needed
+    attributes = None
+    fixes = None
+    defaults = None
+
+    # attributes are immutable, so requirements share one instance per (name, value, strict)
+    _instances = {}
 
     def __init__(self, name, value, strict):
-        self.name = name
+        Attribute.loadConfig()
+        self.name = sys.intern(name)
         self.strict = strict
-        self.value = self.fixValue(name, value)
+        self.order = -1
+
+        fixed = self.fixValue(name, value)
+        if name in self.attributes.keys() and fixed in self.attributes[name]['values']:
+            self.order = self.attributes[name]['values'].index(fixed)
+
         if not self.isValid():
             raise InvalidAttribute("The value '%s' is not valid for attribute '%s'" % (value, name))
 
+    @staticmethod
+    def loadConfig():
+        if Attribute.attributes is None:
+            Attribute.fixes = config.getPredefinedValueAttributeFixes()
+            Attribute.defaults = config.getPredefinedValueAttributeDefaults()
+            Attribute.attributes = config.getPredefinedValueAttributes()
+
+    @staticmethod
+    def get(name, value, strict):
+        """ The shared Attribute instance for the given, possibly unfixed, value """
+        key = (name, value, strict)
+        attr = Attribute._instances.get(key)
+        if attr is None:
+            attr = Attribute(name, value, strict)
+            Attribute._instances[key] = attr
+
+        return attr
+
     @staticmethod
     def getDescription(t):
+        Attribute.loadConfig()
         result = None
         if t in Attribute.attributes.keys():
             result = Attribute.attributes[t]['description']
@@ -26,6 +59,7 @@ class Attribute:
 
     @staticmethod
     def getAttributeValues(t):
+        Attribute.loadConfig()
         result = None
         if t in Attribute.attributes.keys():
             result = Attribute.attributes[t]['values']
@@ -67,49 +101,53 @@ class Attribute:
         return result
 
     def getValue(self):
-        return self.value
+        # attributes may come from the parse cache, without any other attribute built in this process
+        if Attribute.attributes is None:
+            Attribute.loadConfig()
+
+        result = None
+        if self.order >= 0:
+            result = self.attributes[self.name]['values'][self.order]
+
+        return result
 
     def getName(self):
         return self.name
 
     def isValid(self):
-        valid = (self.name in self.attributes.keys()) and (self.value in self.attributes[self.name]['values'])
-
-        return valid
+        return self.order >= 0
 
     def getOrder(self):
-        c = -1
-
-        if self.isValid():
-            c = self.attributes[self.name]['values'].index(self.value)
-
-        return c
+        return self.order
 
 class Requirement:
+    __slots__ = ('reqCategory', 'strict', 'id', 'reqID', 'text', 'links', 'attributes')
+
     def __init__(self, category, strict, attributes):
-        self.reqCategory = category
+        self.reqCategory = sys.intern(category)
         self.strict = strict
 
         self._setupRequiredAttrs(attributes)
         self._setupPredefinedValueAttributes(attributes)
 
     def getAttribute(self, name):
-        result = None
+        # a handful of predefined attributes at most, a scan is cheaper than a dict per requirement
         for a in self.attributes:
-            if a.getName() == name:
-                result = a.getValue()
+            if a.name == name:
+                return a.getValue()
 
-        return result
+        return None
 
     def _setupPredefinedValueAttributes(self, attributes):
         newattributes = []
 
-        predefAttrs = config.getPredefinedValueAttributes()
+        Attribute.loadConfig()
+        predefAttrs = Attribute.attributes
         for name in predefAttrs.keys():
             if name in attributes.keys():
-                newattributes.append(  Attribute(name, attributes[name], self.strict) )
+                newattributes.append(  Attribute.get(name, attributes[name], self.strict) )
 
-        self.attributes = newattributes
+        self.attributes = tuple(newattributes)
 
     def _setupRequiredAttrs(self, attributes):
         reqAttrs = config.getMandatoryAttributes()
@@ -130,11 +168,8 @@ class Requirement:
             self.links = []
 
     def getAttributes(self):
-        attrs = []
-        for a in self.attributes:
-            attrs.append(Attribute(a.getName(), a.getValue(), a.strict))
-
-        return attrs
+        # attributes are immutable and shared, no need to hand out copies
+        return self.attributes
 
     def getDomain(self):
         return self.getAttribute("SecurityDomain")
@@ -0,0 +1,153 @@
+import os, sqlite3, hashlib, json
+from collections import OrderedDict
+
+# similarities are written out in batches of this many, so that the buffer stays small
+# however many cells a scan computes
+SIMILARITY_BATCH = 10000
+
+
+class LRUCache:
+    """ Bounded in-memory map, evicting the least recently used entries first """
+
+    def __init__(self, size):
+        self.size = size
+        self.data = OrderedDict()
+
+    def __contains__(self, key):
+        return key in self.data
+
+    def get(self, key):
+        value = self.data[key]
+        self.data.move_to_end(key)
+        return value
+
+    def put(self, key, value):
+        self.data[key] = value
+        self.data.move_to_end(key)
+        if len(self.data) > self.size:
+            self.data.popitem(last=False)
+
+class SemanticCache:
+    """ Persistent store for the expensive parts of the semantic scan, surviving across runs:
+
+        - tokens: (word, wordnet tag) -> synset name, or None if the word has no synset
+        - vectors: requirement text hash -> synset names of the sentence
+        - similarities: (synset name, synset name) -> path_similarity, or None
+
+        Lookups go through an LRU layer; writes are buffered and flushed in a single
+        transaction by commit(), similarities also every SIMILARITY_BATCH of them """
+
+    def __init__(self, path, lruSize=100000):
+        directory = os.path.dirname(path)
+        if directory != "":
+            os.makedirs(directory, exist_ok=True)
+
+        self.connection = sqlite3.connect(path)
+        self.connection.execute("CREATE TABLE IF NOT EXISTS tokens (word TEXT, tag TEXT, synset TEXT, PRIMARY KEY (word, tag)) WITHOUT ROWID")
+        self.connection.execute("CREATE TABLE IF NOT EXISTS vectors (hash TEXT PRIMARY KEY, synsets TEXT) WITHOUT ROWID")
+        self.connection.execute("CREATE TABLE IF NOT EXISTS similarities (a TEXT, b TEXT, score REAL, PRIMARY KEY (a, b)) WITHOUT ROWID")
+        # the columns of a few synsets are looked up by their second synset
+        self.connection.execute("CREATE INDEX IF NOT EXISTS similarities_b ON similarities (b)")
+        self.connection.commit()
+
+        self.tokens = LRUCache(lruSize)
+        self.vectors = LRUCache(lruSize)
+        self.pendingTokens = []
+        self.pendingVectors = []
+        self.pendingSimilarities = []
+
+    @staticmethod
+    def textHash(text):
+        return hashlib.sha1(str(text).encode("utf-8")).hexdigest()
+
+    def getToken(self, word, tag):
+        """ (found, synset name) for a tagged word """
+        key = (word, tag)
+        if key in self.tokens:
+            return (True, self.tokens.get(key))
+
+        row = self.connection.execute("SELECT synset FROM tokens WHERE word = ? AND tag = ?", key).fetchone()
+        if row is None:
+            return (False, None)
+
+        self.tokens.put(key, row[0])
+        return (True, row[0])
+
+    def putToken(self, word, tag, synset):
+        self.tokens.put( (word, tag), synset )
+        self.pendingTokens.append( (word, tag, synset) )
+
+    def getVector(self, text):
+        """ The synset names of a sentence, or None if it was never seen """
+        key = SemanticCache.textHash(text)
+        if key in self.vectors:
+            return self.vectors.get(key)
+
+        row = self.connection.execute("SELECT synsets FROM vectors WHERE hash = ?", (key, )).fetchone()
+        if row is None:
+            return None
+
+        vector = json.loads(row[0])
+        self.vectors.put(key, vector)
+        return vector
+
+    def putVector(self, text, synsets):
+        key = SemanticCache.textHash(text)
+        self.vectors.put(key, synsets)
+        self.pendingVectors.append( (key, json.dumps(synsets)) )
+
+    def _want(self, table, names):
+        self.connection.execute("CREATE TEMP TABLE IF NOT EXISTS %s (name TEXT PRIMARY KEY) WITHOUT ROWID" % table)
+        self.connection.execute("DELETE FROM %s" % table)
+        self.connection.executemany("INSERT OR IGNORE INTO %s VALUES (?)" % table, ((name, ) for name in names))
+
+    def loadSimilarities(self, names, rows=None, columns=None):
+        """ The known similarities between the given synsets, as ((a, b), score) pairs read from
+            the database while they are iterated over. When given rows and/or columns, only the
+            similarities (a, b) with a in rows or b in columns are loaded (those with both can
+            come twice): the cost is then in proportion to their number, not to the square of
+            names """
+        self._want("wanted", names)
+        if rows is None and columns is None:
+            query = "SELECT s.a, s.b, s.score FROM similarities s JOIN wanted wa ON s.a = wa.name JOIN wanted wb ON s.b = wb.name"
+            for a, b, score in self.connection.execute(query):
+                yield ((a, b), score)
+
+            return
+
+        # CROSS JOIN makes SQLite start from the few wanted rows or columns, instead of scanning the table
+        if rows is not None:
+            self._want("wantedRows", rows)
+            query = "SELECT s.a, s.b, s.score FROM wantedRows r CROSS JOIN similarities s ON s.a = r.name JOIN wanted w ON s.b = w.name"
+            for a, b, score in self.connection.execute(query):
+                yield ((a, b), score)
+
+        if columns is not None:
+            self._want("wantedColumns", columns)
+            query = "SELECT s.a, s.b, s.score FROM wantedColumns c CROSS JOIN similarities s ON s.b = c.name JOIN wanted w ON s.a = w.name"
+            for a, b, score in self.connection.execute(query):
+                yield ((a, b), score)
+
+    def putSimilarity(self, a, b, score):
+        self.pendingSimilarities.append( (a, b, score) )
+        if len(self.pendingSimilarities) >= SIMILARITY_BATCH:
+            self.flushSimilarities()
+
+    def flushSimilarities(self):
+        with self.connection:
+            self.connection.executemany("INSERT OR REPLACE INTO similarities VALUES (?, ?, ?)", self.pendingSimilarities)
+
+        self.pendingSimilarities = []
+
+    def commit(self):
+        with self.connection:
+            self.connection.executemany("INSERT OR REPLACE INTO tokens VALUES (?, ?, ?)", self.pendingTokens)
+            self.connection.executemany("INSERT OR REPLACE INTO vectors VALUES (?, ?)", self.pendingVectors)
+
+        self.pendingTokens = []
+        self.pendingVectors = []
+        self.flushSimilarities()
+
+    def close(self):
+        self.commit()
+        self.connection.close()
@@ -0,0 +1,93 @@
+import os, hashlib, json
+import config
+from .cache import defaultCacheDir
+
+
+
+
+
+# bump whenever the rendering of the sheets changes
+SHEET_CACHE_VERSION = 2
+
+def requirementInputs(req):
+    """ Everything about a requirement that can show in a rendered sheet """
+    attributes = [ (a.getName(), a.getValue(), a.getOrder()) for a in req.getAttributes() ]
+    return [ req.getID(), req.getCategory(), req.getText(), req.getFullText(), list(req.getLinks()), attributes ]
+
+class SheetCache:
+    """ On-disk cache of the sheets of the rendered maps, each one saved as the XML fragment
+        it takes in content.xml. An entry is keyed by a hash of all the inputs of its sheet
+        (the requirements it shows, the rendering flags) and of the parts of the configuration
+        used when rendering (attributes, markers, styles and sort order), so an entry is only
+        ever reused for the very same sheet """
+
+    def __init__(self, directory=defaultCacheDir):
+        self.directory = directory
+        self.configInputs = None
+
+    def _configInputs(self):
+        if self.configInputs is None:
+            styles = dict( (what, config.getMapStyle(what)) for what in [ "unknown", "business", "user", "system" ] )
+            self.configInputs = [ config.getAllAttributes(), config.getAttributeMarkers(), styles, config.getSortOrder() ]
+
+        return self.configInputs
+
+    def key(self, inputs):
+        data = json.dumps([ SHEET_CACHE_VERSION, self._configInputs(), inputs ], sort_keys=True, default=str)
+        return hashlib.sha256(data.encode("utf-8")).hexdigest()
+
+    def path(self, key):
+        return os.path.join(self.directory, "sheet-%s.xml" % key)
+
+    def has(self, key):
+        return os.path.exists(self.path(key))
+
+    def store(self, key, write):
+        """ Save the entry of key, write(output) writing the fragment to the binary file output """
+        os.makedirs(self.directory, exist_ok=True)
+        path = self.path(key)
+
+        # write to a temporary file and rename, so an interrupted run never leaves a truncated entry
+        tmp = "%s.%d.tmp" % (path, os.getpid())
+        with open(tmp, "wb") as f:
+            write(f)
+
+        os.replace(tmp, path)
+
+    def manifestPath(self, filename):
+        name = hashlib.sha1(os.path.abspath(filename).encode("utf-8")).hexdigest()
+        return os.path.join(self.directory, "map-%s.json" % name)
+
+    def prune(self, filename, keys):
+        """ Record keys as the sheets of the map filename, and evict the entries no map uses anymore.
+            The cache directory can be shared by several maps (other projects, other sources), each
+            one keeps the sheets it was last rendered with; the maps that do not exist anymore are
+            forgotten """
+        if not os.path.isdir(self.directory):
+            return
+
+        manifest = self.manifestPath(filename)
+        tmp = "%s.%d.tmp" % (manifest, os.getpid())
+        with open(tmp, "w") as f:
+            json.dump({ "map": os.path.abspath(filename), "keys": list(keys) }, f)
+
+        os.replace(tmp, manifest)
+
+        keep = set()
+        for name in os.listdir(self.directory):
+            if name.startswith("map-") and name.endswith(".json"):
+                path = os.path.join(self.directory, name)
+                try:
+                    with open(path, "r") as f:
+                        entry = json.load(f)
+                except Exception:
+                    entry = None
+
+                if entry is None or (path != manifest and not os.path.exists(entry.get("map", ""))):
+                    os.remove(path)
+                else:
+                    keep.update("sheet-%s.xml" % key for key in entry.get("keys", []))
+
+        for name in os.listdir(self.directory):
+            if name.startswith("sheet-") and name.endswith(".xml") and name not in keep:
+                os.remove(os.path.join(self.directory, name))
@@ -0,0 +1,72 @@
+import glob, os, shutil, sys, tempfile, unittest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+import config
+config._configFileName = os.path.join(ROOT, "config.yaml")
+
+from requirements import Requirement, ShardedRenderer
+from xmind import XMindReader
+from xmind.reader import SheetRecord
+
+
+def requirement(category, reqID, links):
+    return Requirement(category, False, { "ID": reqID, "CodeName": reqID, "Requirement": "Text of %s" % reqID, "Link": "\n".join(links) })
+
+def programme():
+    """ Business requirements with trees of 3 to 17 topics, so that the chapters are split in
+        shards of various numbers of requirements """
+    reqs = {}
+    business = []
+    system = []
+    for b in range(0, 12):
+        users = []
+        for u in range(0, b % 5 + 1):
+            systems = [ "S%d.%d.%d" % (b, u, s) for s in range(0, b % 3 + 1) ]
+            for reqID in systems:
+                reqs[reqID] = requirement("system", reqID, [])
+
+            system += systems
+            users.append("U%d.%d" % (b, u))
+            reqs[users[-1]] = requirement("user", users[-1], systems)
+
+        business.append("B%d" % b)
+        reqs[business[-1]] = requirement("business", business[-1], users)
+
+    chapters = [ { 'category': 'business', 'name': 'Business', 'reqs': business },
+                 { 'category': 'system', 'name': 'System', 'reqs': system } ]
+    return chapters, reqs
+
+class ShardTopicsTest(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    @staticmethod
+    def countTopics(filename):
+        """ The number of topics of each sheet of a map, root topics included """
+        counts = {}
+        with XMindReader(filename) as reader:
+            for record in reader.topics(with_sheets=True):
+                if not isinstance(record, SheetRecord):
+                    counts[record.sheet_id] = counts.get(record.sheet_id, 0) + 1
+
+        return counts
+
+    def testShardsFitTheBudget(self):
+        for topicBudget in (19, 25, 40):
+            chapters, reqs = programme()
+            ShardedRenderer(chapters, reqs, topicBudget).render(os.path.join(self.directory, "map-%d.xmind" % topicBudget))
+
+            shards = glob.glob(os.path.join(self.directory, "map-%d-*.xmind" % topicBudget))
+            self.assertGreater(len(shards), 2)
+            for shard in shards:
+                for sheet, topics in self.countTopics(shard).items():
+                    self.assertLessEqual(topics, topicBudget, "%s has %d topics" % (os.path.basename(shard), topics))
+
+if __name__ == "__main__":
+    unittest.main()
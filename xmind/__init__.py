@@ -6,3 +6,5 @@ mekk.xmind entry API. Provides XMindDocument class
 """
 
 from .document import XMindDocument, ALL_MARKS as XMIND_MARKS
+from .stream import StreamingXMindDocument
+from .reader import XMindReader
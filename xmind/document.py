@@ -6,8 +6,9 @@ Create and parse XMind maps.
 """
 
 from lxml import etree
-import zipfile
+import os, re, zipfile
 from .id_gen import IdGen, qualify_id, unique_id
+from .ziputil import ZipWriter
 from .xmlutil import XmlHelper, ns_name, \
     CONTENT_NSMAP, STYLES_NSMAP, find_xpath
 import logging
@@ -49,7 +50,30 @@ SHAPE_RECTANGLE = "org.xmind.topicShape.rectangle"
 SHAPE_ROUND_RECTANGLE = "org.xmind.topicShape.roundedRect"
 SHAPE_ELLIPSIS = "org.xmind.topicShape.ellipse"
 
-_id_gen = IdGen(26)
+# stands for a sheet added with add_sheet_fragment in the serialized document
+FRAGMENT_MARKER = u" sheet-fragment %d "
+
+def _file_chunks(file_name, size = 1 << 20):
+    """
+    Yields the content of file file_name, size bytes at a time.
+    """
+    with open(file_name, "rb") as f:
+        for chunk in iter(lambda: f.read(size), b""):
+            yield chunk
+
+# namespace declarations, as copied from the document element by tostring
+NS_DECLARATION = re.compile(r' xmlns(?::\w+)?="[^"]*"')
+
+def _serialize_sheet(sheet_tag):
+    """
+    Serialize sheet_tag as it is written in content.xml (pretty printed,
+    one level deep). The sheet is serialized in place: moving it out of its
+    document first would cost a walk of the whole sheet.
+    """
+    etree.indent(sheet_tag, space = "  ", level = 1)
+    text = etree.tostring(sheet_tag, encoding = "unicode", with_tail = False)
+    head_end = text.index(">")
+    return "\n  " + NS_DECLARATION.sub("", text[:head_end]) + text[head_end:]
 
 class DocumentPart(object):
     """
@@ -154,11 +178,11 @@ class Sheet(DocumentPart):
         use ``XMindDocument.create_sheet`` instead.
         """
         sheet_tag = doc.create_child(doc.doc_tag, "sheet",
-                                     id = _id_gen.next())
+                                     id = doc.id_gen.next())
         sheet = Sheet(doc, sheet_tag)
         sheet.set_title(sheet_name)
         topic_tag = doc.create_child(sheet_tag, u"topic",
-                                     id = _id_gen.next())
+                                     id = doc.id_gen.next())
         doc.create_child(topic_tag, u"title").text = root_topic_name
         return sheet
 
@@ -204,6 +228,21 @@ class Topic(DocumentPart):
     def __init__(self, doc, topic_tag):
         DocumentPart.__init__(self, doc)
         self.topic_tag = topic_tag
+        # direct references to the child elements (title, notes,
+        # marker-refs, subtopic blocks...) already found or created,
+        # so that building a topic does not look them up again
+        self._refs = {}
+
+    def _child(self, tag_name):
+        """
+        Internal helper. find_or_create_child on the topic tag,
+        remembering the result.
+        """
+        child = self._refs.get(tag_name)
+        if child is None:
+            child = self.doc.find_or_create_child(self.topic_tag, tag_name)
+            self._refs[tag_name] = child
+        return child
 
     def get_embedded_id(self):
         """
@@ -227,6 +266,13 @@ class Topic(DocumentPart):
         """
         return qualify_id(self.topic_tag.get("id"))
 
+    def get_id(self):
+        """
+        Returns the XMind identifier of the topic, the one used by
+        links to it (``set_link("xmind:#" + topic.get_id())``).
+        """
+        return self.topic_tag.get("id")
+
     def get_correlation_id(self):
         """
         Returns unique identifier for given topic. The identifier
@@ -239,20 +285,32 @@ class Topic(DocumentPart):
         """
         Internal helper. Returns XML tag for subtopics block
         """
-        children_tag = self.doc.find_or_create_child(self.topic_tag, "children")
         mode = detached and "detached" or "attached"
-        #topics_tag = children_tag.xpath("topics[@type='%s']" % mode)
-        #topics_tag[0]
-        topics_tag = find_xpath(
-            children_tag,
-            "%s[@%s='%s']" % (self.doc.xpath_name("topics"),
-                              "type", #self.doc.xpath_name("type"),
-                              mode),
-            single = True, required = False)
+        topics_tag = self._refs.get(mode)
+        if topics_tag is not None:
+            return topics_tag
+
+        children_tag = self._child("children")
+        if self.doc.is_creating:
+            # write-only map, a scan of the few children is enough
+            for element in children_tag.iterfind("topics"):
+                if element.get("type") == mode:
+                    topics_tag = element
+                    break
+        else:
+            #topics_tag = children_tag.xpath("topics[@type='%s']" % mode)
+            #topics_tag[0]
+            topics_tag = find_xpath(
+                children_tag,
+                "%s[@%s='%s']" % (self.doc.xpath_name("topics"),
+                                  "type", #self.doc.xpath_name("type"),
+                                  mode),
+                single = True, required = False)
         if topics_tag is None:
             topics_tag = self.doc.create_child(
                 children_tag, u"topics", type = mode)
 
+        self._refs[mode] = topics_tag
         return topics_tag
 
     def add_subtopic(self, subtopic_title, 
@@ -274,14 +332,17 @@ class Topic(DocumentPart):
         """
         topics_tag = self._subtopics_tag(detached)
         subtopic_tag = self.doc.create_child(topics_tag, u"topic",
-                                             id = _id_gen.next(subtopic_emb_id))
+                                             id = self.doc.id_gen.next(subtopic_emb_id))
 
         if folded:
             subtopic_tag.set("branch", "folded")
 
-        self.doc.create_child(subtopic_tag, u"title").text = subtopic_title
+        subtopic = Topic(self.doc, subtopic_tag)
+        title_tag = self.doc.create_child(subtopic_tag, u"title")
+        title_tag.text = subtopic_title
+        subtopic._refs["title"] = title_tag
 
-        return Topic(self.doc, subtopic_tag)
+        return subtopic
 
     def get_subtopics(self, detached = False):
         """
@@ -297,13 +358,13 @@ class Topic(DocumentPart):
         """
         Change topic title
         """
-        self.doc.find_or_create_child(self.topic_tag, "title").text = title
+        self._child("title").text = title
 
     def get_title(self):
         """
         Returns topic title
         """
-        return self.doc.find_or_create_child(self.topic_tag, "title").text
+        return self._child("title").text
 
     def add_marker(self, marker):
         """
@@ -321,8 +382,7 @@ class Topic(DocumentPart):
              which identifies custom marker from embedded markers
              (see XMindDocument.embed_markers)
         """
-        marker_refs_tag = self.doc.find_or_create_child(
-            self.topic_tag, "marker-refs")
+        marker_refs_tag = self._child("marker-refs")
         self.doc.create_child(
             marker_refs_tag, "marker-ref", attrib={"marker-id": marker})
 
@@ -380,7 +440,7 @@ class Topic(DocumentPart):
              file extension (used to signal the data format, for example
              ``.txt``, ``.html``, ``.zip``, ``.json``)
         """
-        att_name = _id_gen.next() + extension
+        att_name = self.doc.id_gen.next() + extension
         self.doc._create_attachment(att_name, data)
         self.topic_tag.set("{http://www.w3.org/1999/xlink}href",
                            "xap:attachments/" + att_name)
@@ -392,7 +452,7 @@ class Topic(DocumentPart):
         Line breaks are preserved (to mark paragraphs), apart from that
         no formatting is handled.
         """
-        notes_tag = self.doc.find_or_create_child(self.topic_tag, "notes")
+        notes_tag = self._child("notes")
         self.doc.find_or_create_child(notes_tag, "plain").text = note_text
         html_tag = self.doc.find_or_create_child(notes_tag, "html")
         for line in note_text.split("\n"):
@@ -406,21 +466,21 @@ class Topic(DocumentPart):
         Returns note (topic description) text, or empty string
         if it is not present
         """
-        notes_tag = self.doc.find_or_create_child(self.topic_tag, "notes")
+        notes_tag = self._child("notes")
         return self.doc.find_or_create_child(notes_tag, "plain").text
 
     def set_label(self, label_text):
         """
         Sets/replaces topic label (short tag-like annotation)
         """
-        labels_tag = self.doc.find_or_create_child(self.topic_tag, "labels")
+        labels_tag = self._child("labels")
         self.doc.find_or_create_child(labels_tag, "label").text = label_text
 
     def get_label(self):
         """
         Gets topic label (or empty text if missing)
         """
-        labels_tag = self.doc.find_or_create_child(self.topic_tag, "labels")
+        labels_tag = self._child("labels")
         return self.doc.find_or_create_child(labels_tag, "label").text
 
     def set_style(self, style):
@@ -472,7 +532,7 @@ class TopicStyle(object):
         """
         styles = doc.find_or_create_child(doc.styles_tag, "styles")
         if styleid is None:
-            styleid = _id_gen.next()
+            styleid = doc.id_gen.next()
 
         style_tag = doc.create_child(styles, "style",
                                      id = styleid, type="topic")
@@ -503,8 +563,6 @@ class XMindDocument(XmlHelper):
     Whole XMind document representation
     """
 
-    _styles={}
-
     @classmethod
     def create(cls, first_sheet_name, root_topic_name):
         """
@@ -521,10 +579,18 @@ class XMindDocument(XmlHelper):
         return obj
 
     @classmethod
-    def open(cls, filename):
+    def open(cls, filename, lazy = False):
         """
         Open and parse existing mind-map.
+
+        With lazy, returns an ``XMindReader`` instead: read-only, it
+        stream-parses content.xml topic by topic and reads attachments
+        on demand, so that very large maps can be read cheaply.
         """
+        if lazy:
+            from .reader import XMindReader
+            return XMindReader(filename)
+
         archive = zipfile.ZipFile(filename, "r")
         doc_tag = None
         styles_tag = None
@@ -575,6 +641,10 @@ class XMindDocument(XmlHelper):
         self.styles_tag = styles_tag
         self.attachments = (attachments or {})
         self.embed_xmp = None
+        self.fragments = []
+        # per document, so that separate maps can be built concurrently
+        self.id_gen = IdGen(26)
+        self._styles = {}
 
     def create_sheet(self, sheet_name, root_topic_name):
         """
@@ -584,6 +654,43 @@ class XMindDocument(XmlHelper):
                              sheet_name, root_topic_name)
         return sheet
 
+    def remove_sheet(self, sheet):
+        """
+        Remove sheet (and all its topics) from the map.
+        """
+        self.doc_tag.remove(sheet.sheet_tag)
+
+    def write_sheet(self, sheet, output):
+        """
+        Write sheet, serialized as in content.xml, to the binary file
+        output and remove it from the map. The result can be added back
+        to this map, or to another one, with ``add_sheet_fragment``.
+
+        Sheets meant to be reused this way should be created within an
+        ``id_block`` of their own.
+        """
+        output.write(_serialize_sheet(sheet.sheet_tag).encode("utf-8"))
+
+        # emptied first, removing a whole sheet from the tree is much slower
+        sheet.sheet_tag.clear()
+        self.doc_tag.remove(sheet.sheet_tag)
+
+    def add_sheet_fragment(self, file_name):
+        """
+        Add the sheet saved to file file_name by ``write_sheet`` after the
+        sheets of the map. The file is read when the map is saved.
+        """
+        self.doc_tag.append(etree.Comment(FRAGMENT_MARKER % len(self.fragments)))
+        self.fragments.append(file_name)
+
+    def id_block(self, prefix):
+        """
+        Context manager: the identifiers of the topics and sheets created
+        within it start with prefix, and cannot clash with the ones of any
+        other block or of the rest of the map (see IdGen.block).
+        """
+        return self.id_gen.block(prefix)
+
     def create_topic_style(self, *args, **kwargs):
         """
         Create visual topic style (which can be attached
@@ -633,46 +740,69 @@ class XMindDocument(XmlHelper):
         """
         self.embed_xmp = xmp_file_name
 
-    def save(self, output_file_name):
+    def save(self, output_file_name, compress_level = 0, threads = 1):
         """
         Save mindmap to given file.
+
+        The archive is written to a temporary file next to the target,
+        then renamed over it, so an interrupted save never leaves a
+        truncated map behind.
+
+        Arguments
+        ---------
+
+        compress_level : int (default 0)
+            0 stores the members uncompressed, 1 (fastest) to 9 (smallest)
+            compresses them with DEFLATE at that level
+        threads : int (default 1)
+            Number of threads compressing large members, in blocks
         """
-        zipf = zipfile.ZipFile(output_file_name, "w")
+        tmp = "%s.%d.tmp" % (output_file_name, os.getpid())
+        try:
+            with ZipWriter(tmp, compress_level, threads) as zipf:
+                self._save_members(zipf)
 
-        self._add_to_zip(zipf, "content.xml",
-           self._serialize_xml(self.doc_tag))
+            os.replace(tmp, output_file_name)
+        except BaseException:
+            if os.path.exists(tmp):
+                os.remove(tmp)
+            raise
+
+    def _save_members(self, zipf):
+        """
+        Write all the members of the map to ZipWriter zipf.
+        """
+        self._save_content(zipf)
 
         self._add_to_zip(zipf, "styles.xml",
            self._serialize_xml(self.styles_tag))
 
         self._add_to_zip(zipf, "meta.xml", META_FILE_BODY)
 
-        manifest_content = MANIFEST_FILE_BODY
+        manifest_entries = []
 
         for name, data in self.attachments.items():
             path = ATTACHMENTS_DIR + name
             self._add_to_zip(zipf, path, data)
-            manifest_content = manifest_content.replace(
-                "</manifest>",
-                ('<file-entry full-path="%s" media-type=""/>' % path)
-                + "\n</manifest>")
+            manifest_entries.append(path)
 
         if self.embed_xmp:
-            xmpf = zipfile.ZipFile(self.embed_xmp, "r")
-            manifest_content = manifest_content.replace(
-                "</manifest>",
-                '<file-entry full-path="markers/" media-type=""/>'
-                + "\n</manifest>")
-
-            for name in xmpf.namelist():
-                path = "markers/" + name
-                self._add_to_zip(
-                    zipf, path,
-                    xmpf.read(name))
-                manifest_content = manifest_content.replace(
-                    "</manifest>",
-                    ('<file-entry full-path="%s" media-type=""/>' % path)
-                    + "\n</manifest>")
+            with zipfile.ZipFile(self.embed_xmp, "r") as xmpf:
+                manifest_entries.append("markers/")
+
+                for name in xmpf.namelist():
+                    path = "markers/" + name
+                    self._add_to_zip(
+                        zipf, path,
+                        xmpf.read(name))
+                    manifest_entries.append(path)
+
+        # the entries are inserted before the closing tag, one per line
+        manifest_content = MANIFEST_FILE_BODY.replace(
+            "</manifest>",
+            "".join(('<file-entry full-path="%s" media-type=""/>\n' % path)
+                    for path in manifest_entries)
+            + "</manifest>")
 
         self._add_to_zip(zipf, "META-INF/manifest.xml", manifest_content)
 
@@ -703,11 +833,50 @@ class XMindDocument(XmlHelper):
         """
         self.attachments[internal_name] = data
 
+    def _save_content(self, zipf):
+        """
+        Write the content.xml member (sheets and topics) to ZipWriter zipf.
+        """
+        content = self._serialize_xml(self.doc_tag)
+        if len(self.fragments) == 0:
+            self._add_to_zip(zipf, "content.xml", content)
+            return
+
+        # splice the sheet fragments in place of their markers, streaming them from their files
+        pieces = []
+        for n, file_name in enumerate(self.fragments):
+            marker = (u"\n  <!--%s-->" % (FRAGMENT_MARKER % n)).encode("utf-8")
+            head, content = content.split(marker)
+            pieces.append( (head, len(head)) )
+            pieces.append( (file_name, os.path.getsize(file_name)) )
+        pieces.append( (content, len(content)) )
+
+        size = sum(length for piece, length in pieces)
+        self._add_chunks_to_zip(zipf, "content.xml", self._spliced_chunks(pieces), size)
+
+    def _spliced_chunks(self, pieces):
+        for piece, length in pieces:
+            if isinstance(piece, bytes):
+                yield piece
+            else:
+                for chunk in _file_chunks(piece):
+                    yield chunk
+
     def _add_to_zip(self, zipf, name, content):
         """
-        Add member of name name and content content to zipfile zipf.
+        Add member of name name and content content to ZipWriter zipf.
+        """
+        if isinstance(content, str):
+            content = content.encode("utf-8")
+        self._add_chunks_to_zip(zipf, name, [content], len(content))
+
+    def _add_chunks_to_zip(self, zipf, name, chunks, size):
+        """
+        Add member of name name to ZipWriter zipf, its content being the
+        byte strings yielded by chunks (size bytes in total). Large
+        members are compressed in parallel blocks when possible.
         """
-        zipf.writestr(name, content)
+        zipf.write(name, chunks, size)
 
     def _serialize_xml(self, tag):
         """
@@ -5,6 +5,9 @@
 Embedded-id trick handling. See Topic.get_embedded_id for description
 """
 
+import itertools
+from contextlib import contextmanager
+
 PFX_EMBEDDED = "afaf"
 PFX_OTHER = "bfbf"
 PFX_LEN = 4
@@ -33,21 +36,31 @@ def unique_id(id_text):
 
 class IdGen(object):
     """
-    Generate unique identifiers for topics. Used internally.
+    Generate unique identifiers for topics. Used internally, each
+    document has its own generator.
+
+    Drawing identifiers is thread safe: the counter is an
+    itertools.count, which is advanced atomically.
     """
     def __init__(self,
                  length = 26):
-        self.counter = 0
         self.length = length
-        
+        self._start(PFX_OTHER)
+
+    def _start(self, prefix):
+        self.prefix = prefix
+        self.counter = itertools.count(1)
+        # prefix and zero padding of the counter, formatted in one step
+        self.template = "%s%%0%dd" % (prefix.replace("%", "%%"),
+                                     self.length - len(prefix))
+
     def next(self, embedded = None):
         """
         Give next unique id. If embedded is specified, embeds it inside.
         """
-        self.counter += 1
+        counter = next(self.counter)
         if embedded is None:
-            suffix_len = self.length - PFX_LEN
-            identifier = "%s%0*d" % (PFX_OTHER, suffix_len, self.counter)
+            identifier = self.template % counter
             if len(identifier) > self.length:
                 raise Exception("IdGen overflow")
             return identifier
@@ -61,7 +74,7 @@ class IdGen(object):
             # - 4 chars - counter (yeah, rotated if it overflows 10000)
             # - rest -  embedded id
             identifier = "%s%02d%04d" % (PFX_EMBEDDED, lensemb,
-                                         self.counter % 10000)
+                                         counter % 10000)
             rest = self.length - PFX_LEN - 6
             if lensemb <= rest:
                 identifier += "0" * (rest-lensemb)
@@ -74,6 +87,23 @@ class IdGen(object):
 
             return identifier
 
+    @contextmanager
+    def block(self, prefix):
+        """
+        Within the context, give identifiers from a separate block: prefix
+        followed by a counter of its own. Used for parts of a map that are
+        reused in other maps, whose identifiers must not clash with theirs.
+        """
+        if prefix.startswith(PFX_EMBEDDED) or len(prefix) >= self.length:
+            raise Exception("Invalid identifier block prefix: %s" % prefix)
+
+        saved = (self.prefix, self.counter, self.template)
+        self._start(prefix)
+        try:
+            yield self
+        finally:
+            (self.prefix, self.counter, self.template) = saved
+
 if __name__ == "__main__":
     gen = IdGen()
     for x in range(1, 5):
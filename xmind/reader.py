@@ -0,0 +1,142 @@
+# -*- coding: utf-8 -*-
+
+"""
+Cheap, read-only access to existing (possibly very large) maps.
+
+XMindDocument.open parses the whole content.xml in memory and loads all
+the attachments up front. XMindReader stream-parses content.xml instead,
+dropping each topic once it has been read, and reads attachments from the
+archive only when asked for:
+
+>>> with XMindReader("requirements.xmind") as reader:
+...     for topic in reader.topics():
+...         print(topic.id, topic.parent_id, topic.title)
+"""
+
+from lxml import etree
+import zipfile
+from collections import namedtuple
+from .xmlutil import NS_CONTENT, NS_XLINK
+from .document import ATTACHMENTS_DIR
+
+TOPIC = "{%s}topic" % NS_CONTENT
+SHEET = "{%s}sheet" % NS_CONTENT
+TITLE = "{%s}title" % NS_CONTENT
+NOTE = "{%s}notes/{%s}plain" % (NS_CONTENT, NS_CONTENT)
+MARKERS = "{%s}marker-refs/{%s}marker-ref" % (NS_CONTENT, NS_CONTENT)
+LINK = "{%s}href" % NS_XLINK
+
+TopicRecord = namedtuple("TopicRecord",
+    ["id", "title", "note", "markers", "parent_id", "sheet_id", "link"])
+TopicRecord.__doc__ = """
+A topic read by XMindReader.topics: parent_id is None for the root topic
+of a sheet, note and link are None when the topic has none, markers is the
+list of its marker identifiers.
+"""
+
+SheetRecord = namedtuple("SheetRecord", ["id", "title"])
+SheetRecord.__doc__ = """
+A sheet read by XMindReader.topics(with_sheets = True), yielded after all
+its topics.
+"""
+
+class XMindReader(object):
+    """
+    Read-only map, see the module documentation. Usually obtained with
+    ``XMindDocument.open(filename, lazy = True)``.
+    """
+
+    def __init__(self, filename):
+        self.filename = filename
+        self.archive = zipfile.ZipFile(filename, "r")
+        if "content.xml" not in self.archive.namelist():
+            self.archive.close()
+            raise Exception("Invalid xmind file: %s (missing content block)" % filename)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def close(self):
+        self.archive.close()
+
+    def _events(self, events, tag):
+        with self.archive.open("content.xml") as content:
+            for event, element in etree.iterparse(content, events = events,
+                                                  tag = tag, huge_tree = True):
+                yield event, element
+
+    @staticmethod
+    def _drop(element):
+        """
+        Free element, and the siblings of the same kind read before it.
+        """
+        element.clear()
+        parent = element.getparent()
+        previous = element.getprevious()
+        while previous is not None and previous.tag == element.tag:
+            parent.remove(previous)
+            previous = element.getprevious()
+
+    def topics(self, with_sheets = False):
+        """
+        Yields a TopicRecord for each topic of the map (attached or
+        detached). A topic is yielded once it has been read completely,
+        so children come before their parent. Memory use depends on the
+        depth of the map, not on its size.
+
+        With with_sheets, a SheetRecord is also yielded after the topics
+        of each sheet (the title of a sheet may follow its topics, so it
+        is not known before).
+        """
+        for event, element in self._events(("end",), (TOPIC, SHEET)):
+            if element.tag == TOPIC:
+                # topics/children/topic above a subtopic, the sheet above a root topic:
+                # neither has ended yet, so both are still in the tree
+                parent = element.getparent()
+                if parent.tag == SHEET:
+                    parent_id, sheet = None, parent
+                else:
+                    parent = parent.getparent().getparent()
+                    parent_id, sheet = parent.get("id"), parent
+                    while sheet.tag != SHEET:
+                        sheet = sheet.getparent()
+
+                markers = [ marker.get("marker-id")
+                            for marker in element.iterfind(MARKERS) ]
+                yield TopicRecord(element.get("id"), element.findtext(TITLE),
+                                  element.findtext(NOTE), markers, parent_id,
+                                  sheet.get("id"), element.get(LINK))
+
+            elif with_sheets:
+                yield SheetRecord(element.get("id"), element.findtext(TITLE))
+
+            self._drop(element)
+
+    def sheet_titles(self):
+        """
+        Returns the titles of the sheets, by sheet id.
+        """
+        titles = {}
+        for event, element in self._events(("end",), (TOPIC, SHEET)):
+            if element.tag == SHEET:
+                titles[element.get("id")] = element.findtext(TITLE)
+            self._drop(element)
+
+        return titles
+
+    def attachment_names(self):
+        """
+        Return names of all attachments present inside the map.
+        """
+        return [ name[len(ATTACHMENTS_DIR):]
+                 for name in self.archive.namelist()
+                 if name.startswith(ATTACHMENTS_DIR) ]
+
+    def attachment_body(self, name):
+        """
+        Returns body of attachment of given name, read from the archive.
+        """
+        return self.archive.read(ATTACHMENTS_DIR + name)
@@ -0,0 +1,365 @@
+# -*- coding: utf-8 -*-
+
+"""
+Streaming variant of XMindDocument, for maps too large to be kept in memory.
+
+Topics are written out depth-first while the map is being built: a topic is
+serialized as soon as its first subtopic is added (its title, notes, markers
+and style cannot change anymore after that), and closed as soon as a topic
+which is not one of its descendants gets a subtopic. Only the topics on the
+path being built are kept in memory, so memory use is bounded by the depth of
+the map rather than its size.
+
+Each sheet is written to its own temporary file, the content.xml member of
+the map is assembled from them by ``save``. The output is the same as the
+one of XMindDocument (byte for byte).
+
+The price is that the map must be built in order:
+
+>>> doc = StreamingXMindDocument.create(u"Sheet", u"Root")
+>>> root = doc.get_first_sheet().get_root_topic()
+>>> child = root.add_subtopic(u"First")
+>>> child.set_note(u"Allowed, child has no subtopics yet")
+>>> grandchild = child.add_subtopic(u"Grandchild")
+>>> root.add_subtopic(u"Second")     # child and grandchild are written out
+>>> child.add_subtopic(u"Too late")  # raises StreamingError
+"""
+
+from lxml import etree
+import os, tempfile
+from .document import XMindDocument, Sheet, Topic, _file_chunks
+from .xmlutil import CONTENT_NSMAP, STYLES_NSMAP
+
+XML_DECLARATION = u"<?xml version='1.0' encoding='utf-8'?>"
+
+# stands for the streamed children of a topic (or the root topic of a sheet) when
+# a partially built element is serialized
+PLACEHOLDER = u"_"
+
+class StreamingError(Exception):
+    """
+    Raised when a streaming map is not built in order, e.g. when a topic
+    already written out is changed.
+    """
+    pass
+
+def _new_element(tag_name, **kwargs):
+    """
+    Create a detached element inside a wrapper declaring the namespaces of
+    the map, so that its serialization uses the same prefixes as
+    XMindDocument
+    """
+    wrapper = etree.Element("xmap-content", nsmap = CONTENT_NSMAP)
+    return etree.SubElement(wrapper, tag_name, **kwargs)
+
+def _serialize(element, depth):
+    """
+    Serialize element like XMindDocument (pretty printed) would at the given
+    depth, without the namespace declarations of the wrapper. Returns the
+    text before and after the placeholder, if any.
+    """
+    etree.indent(element, space = "  ", level = depth)
+    text = etree.tostring(element.getparent(), encoding = "unicode")
+    text = text[text.index(">") + 1:-len("</xmap-content>")]
+
+    marker = "<%s/>" % PLACEHOLDER
+    if marker in text:
+        head, tail = text.split(marker)
+        return (head.rstrip(), tail)
+
+    return (text, None)
+
+class _Node(object):
+    """
+    An element being streamed: kept in memory until it is started (its head
+    written out), then until it is closed (its tail written out).
+    """
+    def __init__(self, element, depth):
+        self.element = element
+        self.depth = depth
+        self.started = False
+        self.closed = False
+        self.tail = None
+
+class StreamingTopic(Topic):
+    """
+    Topic of a streaming map. Can only be changed until its first subtopic
+    is added.
+    """
+    def __init__(self, doc, sheet, node):
+        Topic.__init__(self, doc, node.element)
+        self.sheet = sheet
+        self.node = node
+
+    def _check_pending(self):
+        if self.node.started or self.node.closed:
+            raise StreamingError(
+                "Topic '%s' was already written out, it cannot be changed" %
+                self.topic_tag.findtext("title"))
+
+    def add_subtopic(self, subtopic_title,
+                     subtopic_emb_id = None, detached = False, folded = True):
+        """
+        Create new topic as a child of this topic, writing out this topic
+        first if needed. See Topic.add_subtopic.
+        """
+        if self.node.closed:
+            raise StreamingError(
+                "Topic '%s' was already closed, it cannot get new subtopics" %
+                self.topic_tag.findtext("title"))
+
+        mode = detached and "detached" or "attached"
+        self.sheet._enter(self.node, mode)
+
+        subtopic_tag = _new_element(u"topic",
+                                    id = self.doc.id_gen.next(subtopic_emb_id))
+        if folded:
+            subtopic_tag.set("branch", "folded")
+
+        self.doc.create_child(subtopic_tag, u"title").text = subtopic_title
+
+        node = _Node(subtopic_tag, self.node.depth + 3)
+        self.sheet._push(node)
+        return StreamingTopic(self.doc, self.sheet, node)
+
+    def get_subtopics(self, detached = False):
+        raise StreamingError("Subtopics of a streaming map cannot be read back")
+
+    def set_title(self, title):
+        self._check_pending()
+        Topic.set_title(self, title)
+
+    def add_marker(self, marker):
+        self._check_pending()
+        Topic.add_marker(self, marker)
+
+    def set_link(self, url):
+        self._check_pending()
+        Topic.set_link(self, url)
+
+    def set_attachment(self, data, extension):
+        self._check_pending()
+        Topic.set_attachment(self, data, extension)
+
+    def set_note(self, note_text):
+        self._check_pending()
+        Topic.set_note(self, note_text)
+
+    def set_label(self, label_text):
+        self._check_pending()
+        Topic.set_label(self, label_text)
+
+    def set_style(self, style):
+        self._check_pending()
+        Topic.set_style(self, style)
+
+class StreamingSheet(Sheet):
+    """
+    Sheet of a streaming map, written to its own temporary file.
+    """
+    def __init__(self, doc, sheet_name, root_topic_name):
+        sheet_tag = _new_element("sheet", id = doc.id_gen.next())
+        Sheet.__init__(self, doc, sheet_tag)
+        self.set_title(sheet_name)
+
+        self.output = tempfile.TemporaryFile()
+        self.node = _Node(sheet_tag, 1)
+        self.stack = [self.node]
+
+        # the root topic is streamed in place of the placeholder of the sheet
+        doc.create_child(sheet_tag, PLACEHOLDER)
+        topic_tag = _new_element(u"topic", id = doc.id_gen.next())
+        doc.create_child(topic_tag, u"title").text = root_topic_name
+        root_node = _Node(topic_tag, 2)
+        self.stack.append(root_node)
+        self.root_topic = StreamingTopic(doc, self, root_node)
+
+    def _write(self, text):
+        self.output.write(text.encode("utf-8"))
+
+    def _start(self, node, container):
+        """
+        Write out the head of node, up to the (new) container of its children
+        """
+        if container is not None:
+            etree.SubElement(container, PLACEHOLDER)
+
+        head, node.tail = _serialize(node.element, node.depth)
+        self._write("\n" + "  " * node.depth + head)
+        node.started = True
+
+    def _close(self, node):
+        if node.started:
+            self._write(node.tail)
+        else:
+            text, tail = _serialize(node.element, node.depth)
+            self._write("\n" + "  " * node.depth + text)
+
+        node.closed = True
+
+    def _push(self, node):
+        self.stack.append(node)
+
+    def _enter(self, node, mode):
+        """
+        Prepare node to receive a subtopic: close its open descendants and
+        write out its head (and the one of the sheet) if not done yet.
+        """
+        if node not in self.stack:
+            raise StreamingError("Topic is not part of the sheet being written")
+
+        while self.stack[-1] is not node:
+            self._close(self.stack.pop())
+
+        if not self.node.started:
+            self._start(self.node, None)
+
+        if node.started:
+            if node.mode != mode:
+                raise StreamingError(
+                    "Attached and detached subtopics cannot be mixed in a streaming map")
+        else:
+            children_tag = self.doc.create_child(node.element, "children")
+            self._start(node, self.doc.create_child(
+                children_tag, u"topics", type = mode))
+            node.mode = mode
+
+    def set_title(self, title):
+        if getattr(self, "node", None) is not None and self.node.started:
+            raise StreamingError("Sheet was already written out, its title cannot be changed")
+        Sheet.set_title(self, title)
+
+    def get_root_topic(self):
+        return self.root_topic
+
+    def get_legend(self):
+        if self.node.started:
+            raise StreamingError("Sheet was already written out, it cannot get a legend")
+        return Sheet.get_legend(self)
+
+    def finish(self):
+        """
+        Close all the open topics and the sheet itself.
+        """
+        if not self.node.started:
+            self._start(self.node, None)
+
+        while len(self.stack) > 0:
+            self._close(self.stack.pop())
+
+    def size(self):
+        self.output.flush()
+        return self.output.tell()
+
+    def chunks(self, size = 1 << 20):
+        """
+        Yields the content of the sheet, size bytes at a time.
+        """
+        self.output.seek(0)
+        for chunk in iter(lambda: self.output.read(size), b""):
+            yield chunk
+
+    def discard(self):
+        self.output.close()
+
+class _SheetFragment(object):
+    """
+    Sheet of a streaming map added with add_sheet_fragment, read from its
+    file when the map is saved.
+    """
+    def __init__(self, file_name):
+        self.file_name = file_name
+
+    def finish(self):
+        pass
+
+    def size(self):
+        return os.path.getsize(self.file_name)
+
+    def chunks(self):
+        return _file_chunks(self.file_name)
+
+    def discard(self):
+        pass
+
+class StreamingXMindDocument(XMindDocument):
+    """
+    XMindDocument writing topics out while they are created, see the module
+    documentation. Styles and attachments are kept in memory as usual.
+    """
+
+    @classmethod
+    def create(cls, first_sheet_name, root_topic_name):
+        doc_tag = etree.Element(
+            "xmap-content", nsmap = CONTENT_NSMAP, version = "2.0")
+        styles_tag = etree.Element(
+            "xmap-styles", nsmap = STYLES_NSMAP, version = "2.0")
+        obj = StreamingXMindDocument(True, doc_tag, styles_tag)
+        obj.create_sheet(first_sheet_name, root_topic_name)
+        return obj
+
+    @classmethod
+    def open(cls, filename):
+        raise StreamingError("Streaming maps can only be written, use XMindDocument.open")
+
+    def __init__(self, is_creating, doc_tag, styles_tag, attachments = None):
+        XMindDocument.__init__(self, is_creating, doc_tag, styles_tag, attachments)
+        self.sheets = []
+
+    def create_sheet(self, sheet_name, root_topic_name):
+        sheet = StreamingSheet(self, sheet_name, root_topic_name)
+        self.sheets.append(sheet)
+        return sheet
+
+    def remove_sheet(self, sheet):
+        sheet.discard()
+        self.sheets.remove(sheet)
+
+    def write_sheet(self, sheet, output):
+        """
+        See XMindDocument.write_sheet, the sheet is copied from its
+        temporary file.
+        """
+        sheet.finish()
+        for chunk in sheet.chunks():
+            output.write(chunk)
+        self.remove_sheet(sheet)
+
+    def add_sheet_fragment(self, file_name):
+        self.sheets.append(_SheetFragment(file_name))
+
+    def get_first_sheet(self):
+        return self.sheets[0]
+
+    def get_all_sheets(self):
+        for sheet in self.sheets:
+            yield sheet
+
+    def pretty_print(self):
+        raise StreamingError("Streaming maps cannot be printed")
+
+    def _content_chunks(self, head, tail):
+        yield head
+        for sheet in self.sheets:
+            for chunk in sheet.chunks():
+                yield chunk
+            sheet.discard()
+        yield tail
+
+    def _save_content(self, zipf):
+        """
+        Assemble content.xml from the sheets, without loading them in memory.
+        """
+        for sheet in self.sheets:
+            sheet.finish()
+
+        # the document element, without its (empty) content
+        envelope = etree.tostring(self.doc_tag, encoding = "unicode")
+        head = envelope[:-len("/>")] + ">"
+
+        head = (XML_DECLARATION + "\n" + head).encode("utf-8")
+        tail = u"\n</xmap-content>\n".encode("utf-8")
+        size = len(head) + sum(sheet.size() for sheet in self.sheets) + len(tail)
+        self._add_chunks_to_zip(zipf, "content.xml", self._content_chunks(head, tail), size)
+
+        self.sheets = []
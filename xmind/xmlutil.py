@@ -68,6 +68,19 @@ def ns_name(ns_shortcut, what):
     """
     return "{%s}%s" % (SEARCH_NSMAP[ns_shortcut], what)
 
+_compiled_xpaths = {}
+
+def compiled_xpath(expression):
+    """
+    Return the etree.XPath object for expression (handling namespace
+    shortcuts), compiling it only the first time it is used.
+    """
+    xpath = _compiled_xpaths.get(expression)
+    if xpath is None:
+        xpath = etree.XPath(expression, namespaces = SEARCH_NSMAP)
+        _compiled_xpaths[expression] = xpath
+    return xpath
+
 def find_xpath(parent, expression, single = False, required = False):
     """
     Look inside parent for elements satisfying XPath expression, returns
@@ -79,7 +92,7 @@ def find_xpath(parent, expression, single = False, required = False):
 
     If required is set, raises InternalStructureException if nothing is found.
     """
-    found_items = parent.xpath(expression, namespaces = SEARCH_NSMAP)
+    found_items = compiled_xpath(expression)(parent)
     if required and (not found_items):
         raise InternalStructureException(
             "Bad structure. Element %s not found under %s" % (
@@ -99,6 +112,8 @@ def find_xpath(parent, expression, single = False, required = False):
 # Kontekstowe
 ############################################################################3
 
+_optional_ns_fullnames = {}
+
 def _optional_ns_fullname(name):
     """
     If name contains colon, performs ns_name on it, otherwise returns
@@ -109,11 +124,15 @@ def _optional_ns_fullname(name):
          >>> _optional_ns_fullname("svg:width")
          "{http://www.w3.org/2000/svg}width"
     """
-    i = name.find(":")
-    if i >= 0:
-        return ns_name(name[0:i], name[i+1:])
-    else:
-        return name
+    fullname = _optional_ns_fullnames.get(name)
+    if fullname is None:
+        i = name.find(":")
+        if i >= 0:
+            fullname = ns_name(name[0:i], name[i+1:])
+        else:
+            fullname = name
+        _optional_ns_fullnames[name] = fullname
+    return fullname
 
 def _forced_ns_fullname(name, default = "xm"):
     """
@@ -175,16 +194,30 @@ class XmlHelper(object):
         """
         Find child of given name, expecting it will be unique
         """
-        if not self.is_creating:
-            tag_name = "%s:%s" % (self.default, tag_name)
+        if self.is_creating:
+            # the map is being written: a plain lookup of the
+            # (non-prefixed) tag is enough, no XPath needed
+            child = parent.find(_optional_ns_fullname(tag_name))
+            if required and child is None:
+                raise InternalStructureException(
+                    "Bad structure. Element %s not found under %s" % (
+                        tag_name, parent))
+            return child
+        tag_name = "%s:%s" % (self.default, tag_name)
         return find_xpath(parent, "./" + tag_name, True, required)
 
     def find_children(self, parent, tag_name, require_non_empty = False):
         """
         Find all children of given name
         """
-        if not self.is_creating:
-            tag_name = "%s:%s" % (self.default, tag_name)
+        if self.is_creating:
+            children = parent.findall(_optional_ns_fullname(tag_name))
+            if require_non_empty and not children:
+                raise InternalStructureException(
+                    "Bad structure. Element %s not found under %s" % (
+                        tag_name, parent))
+            return children
+        tag_name = "%s:%s" % (self.default, tag_name)
         return find_xpath(parent, "./" + tag_name, False, require_non_empty)
 
     def find_or_create_child(self, parent, tag_name):
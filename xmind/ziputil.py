@@ -0,0 +1,275 @@
+# -*- coding: utf-8 -*-
+
+"""
+Writer of the zip archive of a map.
+
+zipfile can only write data it compresses itself, one stream per member.
+Large members of a map are better compressed in blocks by a pool of
+threads (as pigz does), so the archive is written here instead, following
+the zip specification: each member is a local header followed by its
+data, and the central directory comes last. Archives are read back with
+zipfile as usual.
+"""
+
+import struct, time, zlib
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+# sizes and offsets larger than this need the zip64 extensions
+ZIP64_LIMIT = (1 << 31) - 1
+
+# members at least this large are compressed in parallel, in blocks of BLOCK_SIZE
+PARALLEL_MIN_SIZE = 4 << 20
+BLOCK_SIZE = 1 << 20
+
+# a DEFLATE block can refer back to this many bytes of the previous ones
+DEFLATE_WINDOW = 1 << 15
+
+STORED = 0
+DEFLATED = 8
+
+DEFAULT_VERSION = 20
+ZIP64_VERSION = 45
+
+# the name of a member is flagged as utf-8 when it is not plain ascii
+FLAG_UTF8 = 0x800
+
+LOCAL_HEADER = struct.Struct("<4s2B4HL2L2H")
+CENTRAL_HEADER = struct.Struct("<4s4B4HL2L5H2L")
+END_OF_DIRECTORY = struct.Struct("<4s4H2LH")
+END_OF_DIRECTORY64 = struct.Struct("<4sQ2H2L4Q")
+END_OF_DIRECTORY64_LOCATOR = struct.Struct("<4sLQL")
+
+def _dos_date_time(when):
+    year, month, day, hour, minute, second = time.localtime(when)[:6]
+    return (((year - 1980) << 9) | (month << 5) | day,
+            (hour << 11) | (minute << 5) | (second // 2))
+
+def _deflate_block(data, level, previous, last):
+    """
+    Compress data as a piece of a raw DEFLATE stream. The compressor is
+    primed with the end of the previous block, so the ratio is close to
+    the one of a single stream, and flushed to a byte boundary so that
+    the compressed blocks can simply be concatenated (as pigz does).
+    """
+    if previous:
+        compressor = zlib.compressobj(level, zlib.DEFLATED, -zlib.MAX_WBITS,
+                                      zlib.DEF_MEM_LEVEL,
+                                      zlib.Z_DEFAULT_STRATEGY, previous)
+    else:
+        compressor = zlib.compressobj(level, zlib.DEFLATED, -zlib.MAX_WBITS)
+    return compressor.compress(data) + compressor.flush(
+        last and zlib.Z_FINISH or zlib.Z_SYNC_FLUSH)
+
+def _blocks(chunks):
+    """
+    Regroup chunks into (block, end of previous block, is last) tuples.
+    """
+    buffered = b""
+    previous = b""
+    pending = None
+    for chunk in chunks:
+        if buffered:
+            chunk = buffered + chunk
+        offset = 0
+        while len(chunk) - offset >= BLOCK_SIZE:
+            if pending is not None:
+                yield pending + (False, )
+            block = chunk[offset:offset + BLOCK_SIZE]
+            offset += BLOCK_SIZE
+            pending = (block, previous)
+            previous = block[-DEFLATE_WINDOW:]
+        buffered = chunk[offset:]
+
+    if buffered:
+        if pending is not None:
+            yield pending + (False, )
+        pending = (buffered, previous)
+
+    if pending is not None:
+        yield pending + (True, )
+
+class _Member(object):
+    """
+    What the central directory records about a member.
+    """
+    def __init__(self, name, method, date_time, offset):
+        self.name = name.encode("utf-8")
+        self.flags = 0
+        if self.name != name.encode("ascii", "replace"):
+            self.flags = FLAG_UTF8
+        self.method = method
+        self.date, self.time = date_time
+        self.offset = offset
+        self.crc = 0
+        self.compress_size = 0
+        self.file_size = 0
+
+    def local_header(self, zip64):
+        if zip64:
+            extra = struct.pack("<2H2Q", 1, 16, self.file_size, self.compress_size)
+            sizes = (0xFFFFFFFF, 0xFFFFFFFF)
+        else:
+            extra = b""
+            sizes = (self.compress_size, self.file_size)
+
+        return LOCAL_HEADER.pack(b"PK\003\004",
+                                 zip64 and ZIP64_VERSION or DEFAULT_VERSION,
+                                 0, self.flags, self.method, self.time,
+                                 self.date, self.crc, sizes[0], sizes[1],
+                                 len(self.name), len(extra)) \
+            + self.name + extra
+
+    def central_header(self):
+        # the fields which do not fit go to the zip64 extra field, in this order
+        fields = []
+        file_size, compress_size, offset = \
+            self.file_size, self.compress_size, self.offset
+        if file_size > ZIP64_LIMIT:
+            fields.append(file_size)
+            file_size = 0xFFFFFFFF
+        if compress_size > ZIP64_LIMIT:
+            fields.append(compress_size)
+            compress_size = 0xFFFFFFFF
+        if offset > ZIP64_LIMIT:
+            fields.append(offset)
+            offset = 0xFFFFFFFF
+
+        extra = b""
+        version = DEFAULT_VERSION
+        if fields:
+            extra = struct.pack("<2H%dQ" % len(fields), 1, 8 * len(fields),
+                                *fields)
+            version = ZIP64_VERSION
+
+        return CENTRAL_HEADER.pack(b"PK\001\002", version, 3, version, 0,
+                                   self.flags, self.method, self.time,
+                                   self.date, self.crc, compress_size,
+                                   file_size, len(self.name), len(extra),
+                                   0, 0, 0, 0o600 << 16, offset) \
+            + self.name + extra
+
+class ZipWriter(object):
+    """
+    Writes a zip archive to file_name, one member at a time. Members are
+    stored when compress_level is 0, else compressed with DEFLATE at that
+    level; members of at least PARALLEL_MIN_SIZE bytes are compressed in
+    blocks by threads threads when threads is more than 1.
+
+    >>> with ZipWriter("map.xmind", compress_level = 6, threads = 4) as zipf:
+    ...     zipf.write("content.xml", [ b"<xmap-content/>" ], 15)
+    """
+
+    def __init__(self, file_name, compress_level = 0, threads = 1):
+        self.fp = open(file_name, "wb")
+        self.compress_level = compress_level
+        self.threads = threads
+        self.members = []
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is None:
+            self.close()
+        else:
+            self.fp.close()
+
+    def write(self, name, chunks, size):
+        """
+        Add member of name name, its content being the byte strings
+        yielded by chunks. size, the expected number of bytes, only decides
+        whether the member needs zip64 and is compressed in parallel: the
+        sizes recorded are the ones actually written.
+        """
+        method = self.compress_level > 0 and DEFLATED or STORED
+        member = _Member(name, method, _dos_date_time(time.time()),
+                         self.fp.tell())
+
+        # the header is written again once the sizes and the CRC are known,
+        # it must keep its length: same margin as zipfile for compressed data
+        zip64 = size * (method == DEFLATED and 1.05 or 1) > ZIP64_LIMIT
+        self.fp.write(member.local_header(zip64))
+
+        if method == STORED:
+            data = self._stored(chunks)
+        elif self.threads > 1 and size >= PARALLEL_MIN_SIZE:
+            data = self._deflated_blocks(chunks)
+        else:
+            data = self._deflated(chunks)
+
+        crc = 0
+        read = 0
+        written = 0
+        for raw, compressed in data:
+            crc = zlib.crc32(raw, crc)
+            read += len(raw)
+            self.fp.write(compressed)
+            written += len(compressed)
+
+        member.crc = crc
+        member.file_size = read
+        member.compress_size = written
+        if not zip64 and read > ZIP64_LIMIT:
+            raise RuntimeError("File size of %s larger than expected" % name)
+        if not zip64 and written > ZIP64_LIMIT:
+            raise RuntimeError("Compressed size of %s larger than expected"
+                               % name)
+
+        end = self.fp.tell()
+        self.fp.seek(member.offset)
+        self.fp.write(member.local_header(zip64))
+        self.fp.seek(end)
+
+        self.members.append(member)
+
+    def _stored(self, chunks):
+        for chunk in chunks:
+            yield chunk, chunk
+
+    def _deflated(self, chunks):
+        compressor = zlib.compressobj(self.compress_level, zlib.DEFLATED,
+                                      -zlib.MAX_WBITS)
+        for chunk in chunks:
+            yield chunk, compressor.compress(chunk)
+        yield b"", compressor.flush()
+
+    def _deflated_blocks(self, chunks):
+        # zlib releases the GIL while compressing
+        with ThreadPoolExecutor(max_workers = self.threads) as pool:
+            pending = deque()
+            for block, previous, last in _blocks(chunks):
+                pending.append((block, pool.submit(
+                    _deflate_block, block, self.compress_level, previous,
+                    last)))
+                # keep a bounded number of blocks in flight
+                while len(pending) > self.threads * 2:
+                    block, result = pending.popleft()
+                    yield block, result.result()
+
+            while len(pending) > 0:
+                block, result = pending.popleft()
+                yield block, result.result()
+
+    def close(self):
+        """
+        Write the central directory and close the archive.
+        """
+        start = self.fp.tell()
+        for member in self.members:
+            self.fp.write(member.central_header())
+        end = self.fp.tell()
+
+        count, size, offset = len(self.members), end - start, start
+        if count >= 0xFFFF or size > ZIP64_LIMIT or offset > ZIP64_LIMIT:
+            self.fp.write(END_OF_DIRECTORY64.pack(
+                b"PK\006\006", END_OF_DIRECTORY64.size - 12, ZIP64_VERSION,
+                ZIP64_VERSION, 0, 0, count, count, size, offset))
+            self.fp.write(END_OF_DIRECTORY64_LOCATOR.pack(
+                b"PK\006\007", 0, end, 1))
+            count, size, offset = \
+                min(count, 0xFFFF), min(size, 0xFFFFFFFF), min(offset, 0xFFFFFFFF)
+
+        self.fp.write(END_OF_DIRECTORY.pack(b"PK\005\006", 0, 0, count, count,
+                                            size, offset, 0))
+        self.fp.close()